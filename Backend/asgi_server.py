@@ -0,0 +1,452 @@
+"""Async (ASGI) version of the API in server.py.
+
+Handlers use the async Firestore client, so a worker keeps serving other
+requests while one waits on Firestore, and independent reads run
+concurrently. Routes, request bodies and responses match server.py; the
+caches in firebase_code are shared with it.
+
+Run it with an ASGI server, for example:
+
+    gunicorn asgi_server:app -k uvicorn.workers.UvicornWorker
+"""
+
+import asyncio
+import heapq
+import itertools
+import requests
+from functools import wraps
+
+from firebase_admin import firestore, firestore_async
+from quart import Quart, request, g, jsonify
+from quart_cors import cors
+
+from firebase.firebase_code import (
+    verify_token, create_user_with_profile, login_user, search_users,
+    invalidate_user_profile, cache_stats, balance_shard_refs,
+    token_cache, token_cache_key, profile_cache, college_id_cache, college_id_key
+)
+from server import (
+    MAX_PAGE_SIZE, PUBLIC_USER_FIELDS, award_batch, credit_balance,
+    record_transfer, encode_cursor, decode_cursor, encode_search_cursor,
+    decode_search_cursor
+)
+from user_index import DISPLAY_FIELDS
+from keypool import keypair_pool
+
+adb = firestore_async.client()
+
+app = Quart(__name__)
+app = cors(app, allow_origin="https://campuscred-b4e19.web.app")
+
+
+async def verify_token_async(token):
+    # verify_id_token is blocking (it may fetch Google's signing keys), so
+    # only cache misses are sent to a thread.
+    decoded = token_cache.get(token_cache_key(token))
+    if decoded is not None:
+        return decoded
+    return await asyncio.to_thread(verify_token, token)
+
+
+async def get_user_profile_async(uid, use_cache=True):
+    if use_cache:
+        profile = profile_cache.get(uid)
+        if profile is not None:
+            return dict(profile)
+
+    user_ref = adb.collection('users').document(uid)
+    doc = await user_ref.get()
+    if not doc.exists:
+        return None
+    profile = doc.to_dict()
+    if profile.get('balance_shards'):
+        async for shard in adb.get_all(balance_shard_refs(user_ref, profile['balance_shards'])):
+            if shard.exists:
+                shard_data = shard.to_dict()
+                profile['balance'] += shard_data.get('balance', 0)
+                profile['tx_count'] = profile.get('tx_count', 0) + shard_data.get('tx_count', 0)
+    profile_cache.set(uid, profile)
+    return dict(profile)
+
+
+async def resolve_college_id_async(college_id):
+    if not isinstance(college_id, str):
+        return None
+    entry = college_id_cache.get(college_id)
+    if entry is not None:
+        return entry
+
+    index_ref = adb.collection('college_ids').document(college_id_key(college_id))
+    doc = await index_ref.get()
+    if doc.exists:
+        entry = doc.to_dict()
+    else:
+        query = adb.collection('users').where('college_id', '==', college_id).limit(1)
+        users = [user async for user in query.stream()]
+        if not users:
+            return None
+        entry = {"uid": users[0].id, "name": users[0].get('name')}
+        await index_ref.set(entry)
+
+    college_id_cache.set(college_id, entry)
+    return entry
+
+
+def bearer_token():
+    """Returns (token, error response)."""
+    if 'Authorization' not in request.headers:
+        return None, ({'message': 'Token is missing!'}, 401)
+    try:
+        return request.headers['Authorization'].split(' ')[1], None
+    except IndexError:
+        return None, ({'message': 'Bearer token malformed'}, 401)
+
+
+def token_required(f):
+    """Verify the token and set g.uid, leaving the profile read to the
+    handler so it can run it alongside its own reads."""
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        token, error = bearer_token()
+        if error:
+            return error
+        decoded_token = await verify_token_async(token)
+        if not decoded_token:
+            return {'message': 'Token is invalid!'}, 401
+        g.uid = decoded_token['uid']
+        return await f(*args, **kwargs)
+    return decorated_function
+
+
+def login_required(f):
+    @wraps(f)
+    @token_required
+    async def decorated_function(*args, **kwargs):
+        user_profile = await get_user_profile_async(g.uid)
+        if not user_profile:
+            return {'message': 'User profile not found!'}, 401
+        g.user = user_profile
+        return await f(*args, **kwargs)
+    return decorated_function
+
+
+@app.route("/")
+async def hello_world():
+    return "<h1>Hello, World!</h1>"
+
+
+@app.route("/create-user", methods=["POST"])
+async def create_user():
+    data = await request.get_json()
+    if not data:
+        return {"message": "JSON body required"}, 400
+
+    keys = keypair_pool.take()
+    new_user = {
+        "name": data.get('name'),
+        "email": data.get('email'),
+        "password": data.get('password'),
+        "role": data.get('role'),
+        "college_id": data.get('collegeId'),
+        "department": data.get('department'),
+        "public_key": keys[1],
+        "private_key": keys[0],
+        "balance": 50,
+        "tx_count": 0,
+        "feed": True
+    }
+
+    try:
+        # User creation goes through the blocking Admin SDK
+        await asyncio.to_thread(create_user_with_profile, new_user)
+    except Exception as e:
+        return {"message": "Failed to create user: " + str(e)}, 401
+
+    return {"message": "User created successfully"}, 201
+
+
+@app.route("/login", methods=["POST"])
+async def login():
+    data = await request.get_json()
+    if not data:
+        return {"message": "JSON body required"}, 400
+
+    email = data.get("email")
+    password = data.get("password")
+    if not email or not password:
+        return {"message": "Email and password required"}, 400
+
+    try:
+        result = await asyncio.to_thread(login_user, email, password)
+    except requests.RequestException:
+        # Identity Toolkit is down or slow; the password may well be right.
+        # http_client has already logged the failure and counted it in
+        # http_client_requests_total
+        return jsonify({"message": "Login is unavailable, try again later"}), 503
+    if not result:
+        return {"message": "Invalid credentials"}, 401
+
+    return jsonify({
+        "message": "Login successful",
+        "idToken": result["idToken"],
+    }), 200
+
+
+@app.route("/profile")
+@login_required
+async def profile():
+    return jsonify(g.user)
+
+
+@app.route("/users")
+@login_required
+async def users():
+    fields = request.args.get('fields')
+    fields = tuple(fields.split(',')) if fields else DISPLAY_FIELDS
+    if not set(fields) <= set(PUBLIC_USER_FIELDS):
+        return jsonify({"message": f"fields must be among {', '.join(PUBLIC_USER_FIELDS)}"}), 400
+    limit = min(max(request.args.get('limit', MAX_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    after = request.args.get('cursor')
+
+    users_ref = adb.collection('users')
+    query = users_ref.select(list(fields)).order_by('__name__')
+    if after:
+        query = query.start_after({'__name__': users_ref.document(after)})
+    try:
+        docs = [doc async for doc in query.limit(limit + 1).stream()]
+    except Exception:
+        return jsonify({"message": "Failed to retrieve users"}), 500
+
+    next_cursor = docs[limit - 1].id if len(docs) > limit else None
+    return jsonify({
+        "users": [{**doc.to_dict(), "uid": doc.id} for doc in docs[:limit]],
+        "next_cursor": next_cursor
+    })
+
+
+@app.route("/users/search")
+@login_required
+async def users_search():
+    limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_PAGE_SIZE)
+    try:
+        after = decode_search_cursor(request.args.get('cursor'))
+    except (ValueError, TypeError):
+        return jsonify({"message": "Invalid cursor"}), 400
+
+    # The first search in a worker waits for the index to load
+    users, position = await asyncio.to_thread(
+        search_users, request.args.get('q', ''), limit, after, g.user['uid']
+    )
+    return jsonify({"users": users, "next_cursor": encode_search_cursor(position)})
+
+
+@app.route("/cache-stats")
+@login_required
+async def get_cache_stats():
+    return jsonify({**cache_stats(), "keypool": keypair_pool.stats()})
+
+
+async def debit_balance_async(transaction, user_ref, amount, tx_count=1):
+    """Async counterpart of server.debit_balance."""
+    snapshot = await user_ref.get(transaction=transaction)
+    balance = snapshot.get('balance')
+    shards = []
+    if snapshot.to_dict().get('balance_shards'):
+        shard_refs = balance_shard_refs(user_ref, snapshot.get('balance_shards'))
+        shards = [shard async for shard in adb.get_all(shard_refs, transaction=transaction) if shard.exists]
+    balance += sum(shard.get('balance') or 0 for shard in shards)
+    tx_count += sum(shard.to_dict().get('tx_count', 0) for shard in shards)
+
+    if balance < amount:
+        raise Exception("Insufficient funds")
+
+    transaction.update(user_ref, {
+        'balance': balance - amount,
+        'tx_count': firestore.Increment(tx_count)
+    })
+    for shard in shards:
+        transaction.set(shard.reference, {'balance': 0, 'tx_count': 0})
+
+
+async def read_balance_shards_async(transaction, user_ref):
+    """Async counterpart of server.read_balance_shards, for one user."""
+    snapshot = await user_ref.get(transaction=transaction)
+    return snapshot.get('balance_shards') or 0
+
+
+@firestore.async_transactional
+async def update_balances_transactional(transaction, sender_ref, recipient_ref, amount, sender_uid, recipient_uid, sender_name, recipient_name):
+    recipient_shards = await read_balance_shards_async(transaction, recipient_ref)
+    await debit_balance_async(transaction, sender_ref, amount)
+    credit_balance(transaction, recipient_ref, amount, shards=recipient_shards)
+    record_transfer(transaction, sender_uid, recipient_uid, sender_name, recipient_name, amount, client=adb)
+
+
+@app.route("/transactions/send", methods=["POST"])
+@token_required
+async def send_transaction():
+    data = await request.get_json()
+    recipient_college_id = data.get('recipientId')
+    amount = data.get('amount')
+
+    if not recipient_college_id or not amount:
+        return jsonify({"message": "Recipient ID and amount are required"}), 400
+
+    try:
+        amount = int(amount)
+        if amount <= 0:
+            raise ValueError("Amount must be positive")
+    except (ValueError, TypeError):
+        return jsonify({"message": "Invalid amount"}), 400
+
+    # The sender's profile and the recipient don't depend on each other
+    sender, recipient = await asyncio.gather(
+        get_user_profile_async(g.uid),
+        resolve_college_id_async(recipient_college_id)
+    )
+    if not sender:
+        return {'message': 'User profile not found!'}, 401
+
+    if sender['balance'] < amount:
+        return jsonify({"message": "Insufficient funds"}), 400
+    if not recipient:
+        return jsonify({"message": "Recipient not found"}), 404
+
+    sender_uid = sender['uid']
+    recipient_uid = recipient['uid']
+    if sender_uid == recipient_uid:
+        return jsonify({"message": "Cannot send credits to yourself"}), 400
+
+    try:
+        users_ref = adb.collection('users')
+        await update_balances_transactional(
+            adb.transaction(),
+            users_ref.document(sender_uid),
+            users_ref.document(recipient_uid),
+            amount,
+            sender_uid,
+            recipient_uid,
+            sender['name'],
+            recipient['name']
+        )
+
+        invalidate_user_profile(sender_uid, recipient_uid)
+        return jsonify({"message": "Transaction successful"}), 200
+    except Exception as e:
+        invalidate_user_profile(sender_uid)
+        return jsonify({"message": f"Transaction failed: {e}"}), 500
+
+
+@app.route("/transactions/send-batch", methods=["POST"])
+@login_required
+async def send_transaction_batch():
+    data = await request.get_json()
+    # Bulk awards are dominated by their commits, which the batch code
+    # already chunks, so the blocking implementation runs in a thread.
+    body, status = await asyncio.to_thread(award_batch, g.user, data.get('items') if data else None)
+    return jsonify(body), status
+
+
+def ordered_query(collection_ref, query, after, limit):
+    """Same ordering and cursor as server.ordered_transactions, for any
+    query over collection_ref."""
+    query = (
+        query
+        .order_by('timestamp', direction=firestore.Query.DESCENDING)
+        .order_by('__name__', direction=firestore.Query.DESCENDING)
+    )
+    if after:
+        timestamp, doc_id = after
+        query = query.start_after({
+            'timestamp': timestamp,
+            '__name__': collection_ref.document(doc_id)
+        })
+    return query.limit(limit)
+
+
+async def collect(query):
+    return [doc async for doc in query.stream()]
+
+
+async def query_count(query):
+    result = await query.count().get()
+    return result[0][0].value
+
+
+@app.route("/transactions")
+@login_required
+async def get_transactions():
+    user_uid = g.user['uid']
+
+    limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor')
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except (ValueError, KeyError, TypeError):
+        return jsonify({"message": "Invalid cursor"}), 400
+
+    try:
+        if g.user.get('feed'):
+            feed_ref = adb.collection('users').document(user_uid).collection('feed')
+            docs = await collect(ordered_query(feed_ref, feed_ref, after, limit + 1))
+            total = g.user.get('tx_count')
+            if total is None:
+                total = await query_count(feed_ref)
+        else:
+            # Legacy path: the sent and received streams (and the count
+            # aggregations when there is no counter) all run at once.
+            transactions_ref = adb.collection('transactions')
+            queries = [
+                transactions_ref.where('sender_uid', '==', user_uid),
+                transactions_ref.where('recipient_uid', '==', user_uid)
+            ]
+            reads = [collect(ordered_query(transactions_ref, query, after, limit + 1)) for query in queries]
+            if 'tx_count' not in g.user:
+                reads += [query_count(query) for query in queries]
+            results = await asyncio.gather(*reads)
+            merged = heapq.merge(
+                results[0],
+                results[1],
+                key=lambda doc: (doc.get('timestamp'), doc.id),
+                reverse=True
+            )
+            docs = list(itertools.islice(merged, limit + 1))
+            total = g.user['tx_count'] if 'tx_count' in g.user else results[2] + results[3]
+    except Exception as e:
+        return jsonify({"message": f"Failed to retrieve transactions: {e}"}), 500
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1].get('timestamp'), docs[-1].id)
+
+    return jsonify({
+        "transactions": [{**doc.to_dict(), "id": doc.id} for doc in docs],
+        "total": total,
+        "next_cursor": next_cursor
+    })
+
+
+@firestore.async_transactional
+async def mine_coins_transactional(transaction, user_ref):
+    shards = await read_balance_shards_async(transaction, user_ref)
+    credit_balance(transaction, user_ref, 10, tx_count=0, shards=shards)
+
+
+@app.route("/mine", methods=["GET"])
+@login_required
+async def mine():
+    try:
+        user_uid = g.user['uid']
+        user_ref = adb.collection('users').document(user_uid)
+        await mine_coins_transactional(adb.transaction(), user_ref)
+
+        invalidate_user_profile(user_uid)
+        updated_user_profile = await get_user_profile_async(user_uid, use_cache=False)
+
+        return jsonify({
+            "message": "Successfully mined 10 Leafcoin!",
+            "new_balance": updated_user_profile['balance']
+        }), 200
+    except Exception as e:
+        return jsonify({"message": f"Mining failed: {e}"}), 500
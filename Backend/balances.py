@@ -0,0 +1,171 @@
+"""Address balances of the node's chain.
+
+The index keeps every address's balance and transaction count, plus where
+each of its transactions is in the chain, so a balance query is a dict
+lookup instead of a scan of every block. It also keeps the id of every
+transaction in the chain, so a signed transaction is only ever confirmed
+once. It is updated as blocks are appended and rolled back block by block
+on a reorg.
+
+It is saved to a JSON snapshot every few blocks. On restart the snapshot is
+loaded and only the blocks after it are applied; if the chain no longer
+contains the snapshot's tip block, the index is rebuilt from the chain.
+"""
+
+import json
+import os
+import threading
+
+from mempool import transaction_id
+
+# Blocks read from the chain at a time when catching up on load, so a
+# rebuild never holds the whole chain in memory
+LOAD_CHUNK = 1000
+
+
+def transaction_amount(txion):
+    """Amount of a transaction as a number. Wallets may send it as a string;
+    anything that isn't a number moves nothing."""
+    try:
+        amount = float(txion.get('amount'))
+    except (TypeError, ValueError):
+        return 0
+    return int(amount) if amount.is_integer() else amount
+
+
+class BalanceIndex:
+    def __init__(self, snapshot_path=None, snapshot_every=100, save=True):
+        """
+        Args:
+            save (bool): Write snapshots. A second process can load the
+                owner's snapshots without writing its own.
+        """
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        self.save = save
+        # address -> [balance, transaction count]
+        self.balances = {}
+        # address -> [block index, position in the block] of its transactions
+        self.transactions = {}
+        # transaction_id() -> index of the block that confirmed it. Mining
+        # rewards have no signature and aren't kept.
+        self.confirmed = {}
+        self.height = -1
+        self.tip_hash = None
+        self._snapshot_height = -1
+        self._lock = threading.Lock()
+
+    def balance(self, address):
+        """(balance, transaction count) of an address."""
+        balance, tx_count = self.balances.get(address, (0, 0))
+        return balance, tx_count
+
+    def transaction_refs(self, address, before=None, limit=20):
+        """Positions of an address's transactions, newest first, before the
+        before-th one. Returns (refs, cursor for the next page or None)."""
+        refs = self.transactions.get(address, [])
+        end = len(refs) if before is None else max(0, min(before, len(refs)))
+        start = max(0, end - limit)
+        return refs[start:end][::-1], (start if start > 0 else None)
+
+    def _move(self, address, amount, refs, ref, sign):
+        entry = self.balances.setdefault(address, [0, 0])
+        entry[0] += sign * amount
+        entry[1] += sign
+        if sign > 0:
+            refs.setdefault(address, []).append(ref)
+        else:
+            refs[address].pop()
+            if not entry[1]:
+                del self.balances[address]
+                del refs[address]
+
+    def _apply(self, block, sign):
+        txions = list(enumerate(block.transactions))
+        # A rollback undoes the block's transactions in reverse order
+        if sign < 0:
+            txions.reverse()
+        for position, txion in txions:
+            ref = [block.index, position]
+            amount = transaction_amount(txion)
+            sender, recipient = txion.get('from'), txion.get('to')
+            if sender != "network":
+                if sign > 0:
+                    self.confirmed[transaction_id(txion)] = block.index
+                else:
+                    self.confirmed.pop(transaction_id(txion), None)
+            if sender == "network":
+                participants = [(recipient, amount)]
+            elif sender == recipient:
+                participants = [(recipient, 0)]
+            else:
+                participants = [(recipient, amount), (sender, -amount)]
+            if sign < 0:
+                participants.reverse()
+            for address, change in participants:
+                self._move(address, change, self.transactions, ref, sign)
+
+    def apply_update(self, fork, dropped_blocks, new_blocks):
+        """Roll back dropped_blocks (our blocks after index fork) and apply
+        new_blocks in their place."""
+        with self._lock:
+            for block in reversed(dropped_blocks):
+                self._apply(block, -1)
+            self.height = fork
+            for block in new_blocks:
+                self._apply(block, 1)
+                self.height = block.index
+                self.tip_hash = block.hash
+            if self._snapshot_height > fork:
+                # The snapshot's tip is no longer in the chain
+                self._snapshot_height = -1
+            if self.save and self.snapshot_path and self.height - self._snapshot_height >= self.snapshot_every:
+                self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "height": self.height,
+                "tip_hash": self.tip_hash,
+                "balances": self.balances,
+                "transactions": self.transactions,
+                "confirmed": self.confirmed
+            }, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self._snapshot_height = self.height
+
+    def load(self, chain):
+        """Bring the index up to date with chain (a list of Blocks, or a
+        BlockStore), starting from the snapshot if it is still valid."""
+        snapshot = None
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path) as f:
+                    snapshot = json.load(f)
+            except ValueError as e:
+                print(f"Ignoring unreadable balance snapshot: {e}")
+        if snapshot and "confirmed" not in snapshot:
+            print("Balance snapshot has no transaction ids, rebuilding it")
+            snapshot = None
+        height = snapshot["height"] if snapshot else -1
+        if snapshot and (height >= len(chain) or chain[height].hash != snapshot["tip_hash"]):
+            print("Balance snapshot doesn't match the chain, rebuilding it")
+            snapshot, height = None, -1
+
+        with self._lock:
+            if snapshot:
+                self.balances = snapshot["balances"]
+                self.transactions = snapshot["transactions"]
+                self.confirmed = snapshot["confirmed"]
+                self.height = self._snapshot_height = height
+                self.tip_hash = snapshot["tip_hash"]
+            else:
+                self.balances, self.transactions, self.confirmed = {}, {}, {}
+                self.height = self._snapshot_height = -1
+                self.tip_hash = None
+        for start in range(self.height + 1, len(chain), LOAD_CHUNK):
+            self.apply_update(start - 1, [], chain[start:start + LOAD_CHUNK])
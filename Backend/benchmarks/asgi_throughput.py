@@ -0,0 +1,88 @@
+"""Side-by-side throughput of the Flask (server.py) and ASGI (asgi_server.py)
+apps on the same machine.
+
+Start both against the same Firebase project, for example:
+
+    gunicorn server:app -w 4 -b :8000
+    gunicorn asgi_server:app -w 4 -k uvicorn.workers.UvicornWorker -b :8001
+
+then run:
+
+    python benchmarks/asgi_throughput.py --token <idToken> \\
+        --target flask=http://localhost:8000 --target asgi=http://localhost:8001
+
+Every target gets the same paths, concurrency and duration, one after the
+other, and the script prints requests/s and latency percentiles per path.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+DEFAULT_PATHS = ["/profile", "/transactions?limit=20", "/users/search?q=a"]
+
+
+async def worker(client, path, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.get(path)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+                continue
+        except httpx.HTTPError:
+            errors.append(None)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_path(base_url, token, path, concurrency, duration):
+    headers = {"Authorization": f"Bearer {token}"}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies, errors = [], []
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=30) as client:
+        # One warm-up request so caches and connections don't skew the run
+        await client.get(path)
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            worker(client, path, deadline, latencies, errors) for _ in range(concurrency)
+        ))
+    return summarize(latencies, errors, duration)
+
+
+def summarize(latencies, errors, duration):
+    if not latencies:
+        return {"rps": 0.0, "p50_ms": None, "p99_ms": None, "errors": len(errors)}
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "rps": len(latencies) / duration,
+        "p50_ms": quantiles[49] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+        "errors": len(errors)
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--token", required=True, help="Firebase ID token of a test user")
+    parser.add_argument("--target", action="append", required=True, help="name=base_url, repeat per app")
+    parser.add_argument("--path", action="append", help="GET path to load, repeatable")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per path and target")
+    args = parser.parse_args()
+
+    targets = [target.split("=", 1) for target in args.target]
+    print(f"{'path':<28}{'app':<8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for path in args.path or DEFAULT_PATHS:
+        for name, base_url in targets:
+            result = await run_path(base_url, args.token, path, args.concurrency, args.duration)
+            p50 = f"{result['p50_ms']:.1f}" if result["p50_ms"] is not None else "-"
+            p99 = f"{result['p99_ms']:.1f}" if result["p99_ms"] is not None else "-"
+            print(f"{path:<28}{name:<8}{result['rps']:>10.1f}{p50:>10}{p99:>10}{result['errors']:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+"""Time of validating a peer chain: the whole chain from genesis, sequentially
+and on the worker pool, against only the new suffix after the common prefix.
+
+    python benchmarks/chain_validation.py --sizes 10000 100000 1000000
+
+Chains are built with a zero-bit hash target so building them costs one
+hash per block; validation still hashes every header it checks. Every
+--signed-every'th block carries one signed transaction (the same one, so
+signing happens once) on top of its mining reward. Each measurement starts
+from fresh Block objects, as if just parsed from a peer's JSON.
+"""
+
+import argparse
+import base64
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from block import Block, create_genesis_block  # noqa: E402
+from pow_engine import HashTarget  # noqa: E402
+from wallet import generate_ECDSA_keys, sign_ECDSA_msg  # noqa: E402
+import validation  # noqa: E402
+
+
+def signed_transaction():
+    private_key, public_key = generate_ECDSA_keys()
+    signature, message = sign_ECDSA_msg(private_key)
+    return {
+        "from": public_key,
+        "to": base64.b64encode(os.urandom(64)).decode(),
+        "amount": 1,
+        "signature": signature.decode(),
+        "message": message
+    }
+
+
+def build_chain(size, signed_every):
+    reward = {"from": "network", "to": "benchmark-miner", "amount": 1}
+    unsigned = {"difficulty": 0, "transactions": [reward]}
+    signed = {"difficulty": 0, "transactions": [signed_transaction(), reward]}
+    chain = [create_genesis_block()]
+    for index in range(1, size):
+        data = signed if signed_every and index % signed_every == 0 else unsigned
+        chain.append(Block(index, float(index), data, chain[-1].hash))
+    return chain
+
+
+def fresh(chain):
+    """Copies without cached hashes."""
+    return [Block(b.index, b.timestamp, b.data, b.previous_hash, b.nonce) for b in chain]
+
+
+def timed(local_chain, peer_chain, strategy, executor=None):
+    peer_chain = fresh(peer_chain)
+    start = time.perf_counter()
+    validation.validate_chain(local_chain, peer_chain, strategy, executor)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--new-blocks", type=int, default=100, help="blocks the peer has that we don't")
+    parser.add_argument("--signed-every", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    strategy = HashTarget(0)
+    executor = ProcessPoolExecutor(max_workers=args.workers)
+
+    print(f"{'blocks':>10} {'full seq (s)':>13} {'full pool (s)':>14} {'incremental (s)':>16}")
+    for size in args.sizes:
+        chain = build_chain(size, args.signed_every)
+        genesis = chain[:1]
+        local = chain[:max(1, size - args.new_blocks)]
+
+        full_sequential = timed(genesis, chain, strategy)
+        full_pool = timed(genesis, chain, strategy, executor)
+        incremental = timed(local, chain, strategy, executor)
+        print(f"{size:>10} {full_sequential:>13.2f} {full_pool:>14.2f} {incremental:>16.4f}")
+
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+"""In-memory stand-in for the parts of firebase_admin the API server uses,
+so server.py's handlers can be benchmarked offline.
+
+    import fake_firestore
+    client = fake_firestore.install()   # before importing server
+    import server
+
+install() registers fake `firebase_admin`, `firebase_admin.auth`,
+`firebase_admin.credentials` and `firebase_admin.firestore` modules. The
+fake firestore.client() returns one FakeClient that keeps every document
+in dicts. Set FakeClient.latency to add a fixed delay per RPC, as a rough
+model of the round trips to the real service.
+
+The fake auth accepts any ID token of the form "token-<uid>".
+"""
+
+import datetime
+import functools
+import os
+import sys
+import threading
+import time
+import types
+import uuid
+from collections import defaultdict
+from copy import deepcopy
+
+DELETE_FIELD = object()
+SERVER_TIMESTAMP = object()
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+class AlreadyExists(Exception):
+    pass
+
+
+class NotFound(Exception):
+    pass
+
+
+def _apply_fields(current, data):
+    result = dict(current)
+    for field, value in data.items():
+        if value is DELETE_FIELD:
+            result.pop(field, None)
+        elif value is SERVER_TIMESTAMP:
+            result[field] = datetime.datetime.now(datetime.timezone.utc)
+        elif isinstance(value, Increment):
+            result[field] = (result.get(field) or 0) + value.value
+        else:
+            result[field] = deepcopy(value)
+    return result
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return deepcopy(self._data)
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class DocumentReference:
+    def __init__(self, client, collection_path, doc_id):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = doc_id
+        self.path = f"{collection_path}/{doc_id}"
+
+    def collection(self, name):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def _docs(self):
+        return self._client._collections[self._collection_path]
+
+    def get(self, transaction=None):
+        self._client._rpc(reads=1)
+        return DocumentSnapshot(self, deepcopy(self._docs().get(self.id)))
+
+    def set(self, data, merge=False):
+        self._client._commit([("set", self, data, merge)])
+
+    def update(self, data):
+        self._client._commit([("update", self, data, False)])
+
+    def create(self, data):
+        self._client._commit([("create", self, data, False)])
+
+    def delete(self):
+        self._client._commit([("delete", self, None, False)])
+
+
+class AggregationResult:
+    def __init__(self, value):
+        self.value = value
+
+
+class AggregateQuery:
+    def __init__(self, query):
+        self._query = query
+
+    def get(self):
+        return [[AggregationResult(len(self._query._matches()))]]
+
+
+class _Change:
+    def __init__(self, document):
+        self.type = types.SimpleNamespace(name="ADDED")
+        self.document = document
+
+
+class Query:
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+    def __init__(self, client, path, filters=(), orders=(), limit=None, cursor=None, fields=None):
+        self._client = client
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+        self._fields = fields
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                     cursor=self._cursor, fields=self._fields)
+        state.update(changes)
+        return Query(self._client, self._path, **state)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction=ASCENDING):
+        return self._copy(orders=self._orders + ((field, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, values):
+        return self._copy(cursor=values)
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def count(self):
+        return AggregateQuery(self)
+
+    @staticmethod
+    def _value(doc_id, data, field):
+        return doc_id if field == "__name__" else data.get(field)
+
+    def _compare(self, left, right):
+        for field, direction in self._orders:
+            a, b = left[field], right[field]
+            if a != b:
+                result = -1 if a < b else 1
+                return -result if direction == self.DESCENDING else result
+        return 0
+
+    def _matches(self):
+        docs = self._client._collections[self._path]
+        matches = []
+        for doc_id, data in docs.items():
+            if all(self._matches_filter(doc_id, data, f) for f in self._filters):
+                matches.append((doc_id, data))
+        if self._orders:
+            keys = {doc_id: {field: self._value(doc_id, data, field) for field, _ in self._orders}
+                    for doc_id, data in matches}
+            matches.sort(key=functools.cmp_to_key(lambda a, b: self._compare(keys[a[0]], keys[b[0]])))
+            if self._cursor is not None:
+                cursor = {field: self._cursor_value(field) for field, _ in self._orders}
+                matches = [m for m in matches if self._compare(keys[m[0]], cursor) > 0]
+        return matches
+
+    def _cursor_value(self, field):
+        value = self._cursor.get(field)
+        return value.id if isinstance(value, DocumentReference) else value
+
+    def _matches_filter(self, doc_id, data, condition):
+        field, op, value = condition
+        actual = self._value(doc_id, data, field)
+        if op == "==":
+            return actual == value
+        if op == "in":
+            return actual in value
+        if actual is None:
+            return False
+        return {"<": actual < value, "<=": actual <= value, ">": actual > value, ">=": actual >= value}[op]
+
+    def stream(self, transaction=None):
+        matches = self._matches()
+        if self._limit is not None:
+            matches = matches[:self._limit]
+        self._client._rpc(reads=max(1, len(matches)))
+        for doc_id, data in matches:
+            if self._fields is not None:
+                data = {field: data[field] for field in self._fields if field in data}
+            yield DocumentSnapshot(DocumentReference(self._client, self._path, doc_id), deepcopy(data))
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        """Deliver the current documents once, as ADDED changes, from a
+        background thread like the real listener. Later writes are not
+        pushed."""
+        docs = list(self.stream())
+        read_time = datetime.datetime.now(datetime.timezone.utc)
+        threading.Thread(target=callback, args=(docs, [_Change(doc) for doc in docs], read_time),
+                         daemon=True).start()
+        return types.SimpleNamespace(unsubscribe=lambda: None)
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id=None):
+        return DocumentReference(self._client, self._path, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(("set", reference, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(("update", reference, data, False))
+
+    def create(self, reference, data):
+        self._writes.append(("create", reference, data, False))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference, None, False))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        self._client._commit(writes)
+
+
+class Transaction(WriteBatch):
+    pass
+
+
+def transactional(function):
+    """Like firestore.transactional, without retries: nothing else writes
+    to the fake concurrently with a benchmark."""
+    @functools.wraps(function)
+    def wrapper(transaction, *args, **kwargs):
+        result = function(transaction, *args, **kwargs)
+        transaction.commit()
+        return result
+    return wrapper
+
+
+class FakeClient:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.reads = 0
+        self.writes = 0
+        self._collections = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def _rpc(self, reads=0, writes=0):
+        self.reads += reads
+        self.writes += writes
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, path):
+        return CollectionReference(self, path)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self):
+        return Transaction(self)
+
+    def get_all(self, references, transaction=None):
+        self._rpc(reads=len(references))
+        return [DocumentSnapshot(ref, deepcopy(ref._docs().get(ref.id))) for ref in references]
+
+    def _commit(self, writes):
+        """Apply writes atomically: all of them or, if one fails, none."""
+        with self._lock:
+            staged = {}
+            for kind, ref, data, merge in writes:
+                docs = ref._docs()
+                current = staged.get(ref.path, docs.get(ref.id))
+                if kind == "create" and current is not None:
+                    raise AlreadyExists(f"{ref.path} already exists")
+                if kind == "update" and current is None:
+                    raise NotFound(f"{ref.path} not found")
+                if kind == "delete":
+                    staged[ref.path] = None
+                elif kind == "update" or merge:
+                    staged[ref.path] = _apply_fields(current or {}, data)
+                else:
+                    staged[ref.path] = _apply_fields({}, data)
+                staged.setdefault("__refs__", {})[ref.path] = ref
+            for path, ref in staged.pop("__refs__", {}).items():
+                if staged[path] is None:
+                    ref._docs().pop(ref.id, None)
+                else:
+                    ref._docs()[ref.id] = staged[path]
+        self._rpc(writes=len(writes))
+
+
+def _verify_id_token(id_token):
+    if not isinstance(id_token, str) or not id_token.startswith("token-"):
+        raise ValueError("Invalid token")
+    return {"uid": id_token[len("token-"):], "exp": time.time() + 3600}
+
+
+def install(client=None):
+    """Register the fake firebase_admin modules and return their client."""
+    client = client or FakeClient()
+
+    firestore = types.ModuleType("firebase_admin.firestore")
+    firestore.client = lambda app=None: client
+    firestore.transactional = transactional
+    firestore.Increment = Increment
+    firestore.DELETE_FIELD = DELETE_FIELD
+    firestore.SERVER_TIMESTAMP = SERVER_TIMESTAMP
+    firestore.Query = Query
+
+    auth = types.ModuleType("firebase_admin.auth")
+    auth.verify_id_token = _verify_id_token
+    auth.create_user = lambda email=None, password=None, **kwargs: types.SimpleNamespace(uid=uuid.uuid4().hex[:28])
+    auth.delete_user = lambda uid: None
+
+    credentials = types.ModuleType("firebase_admin.credentials")
+    credentials.Certificate = lambda cert: cert
+
+    firebase_admin = types.ModuleType("firebase_admin")
+    firebase_admin._apps = {}
+    firebase_admin.initialize_app = lambda credential=None, **kwargs: firebase_admin._apps.setdefault("[DEFAULT]", credential)
+    firebase_admin.firestore = firestore
+    firebase_admin.auth = auth
+    firebase_admin.credentials = credentials
+
+    sys.modules.update({
+        "firebase_admin": firebase_admin,
+        "firebase_admin.firestore": firestore,
+        "firebase_admin.auth": auth,
+        "firebase_admin.credentials": credentials
+    })
+    os.environ.setdefault("FIREBASE_CONFIG", "{}")
+    os.environ.setdefault("FIREBASE_WEB_API_KEY", "benchmark")
+    return client
@@ -0,0 +1,477 @@
+"""Reproducible benchmarks of the node's, the wallet's and the API's hot
+paths, run offline.
+
+    python benchmarks/suite.py run --output baseline.json
+    ... change something ...
+    python benchmarks/suite.py run --output current.json
+    python benchmarks/suite.py compare baseline.json current.json
+
+Groups (--group, default all of them):
+
+    crypto   Block.hash_block, validate_signature (cold and warm key cache),
+             generate_ECDSA_keys, sign_ECDSA_msg
+    pow      hash rate of each proof-of-work rule, and MiningEngine.search
+             (what proof_of_work() waits on) at low difficulties
+    chain    miner.py's /tip, /blocks?since_hash=, /blocks/fork-point,
+             /balance and /address/<address>/txs, plus incremental
+             validate_chain(), at several chain lengths
+    mempool  Mempool add/select/remove at several pool sizes
+    api      server.py's /profile, /transactions, /transactions/send and
+             /users/search at several history sizes
+
+The api group runs server.py against fake_firestore, an in-memory stand-in
+for Firestore, so it measures the handlers' own work (plus the fake's
+in-memory query evaluation) without network round trips. Pass
+--firestore-latency-ms to add a fixed delay per Firestore call.
+
+Every result has ops/sec (from the median sample) and the p50/p95/p99
+time of one operation, from --samples timed samples. Inputs come from a
+fixed seed. Only compare results from the same machine: compare flags
+every benchmark whose ops/sec dropped by more than --threshold and exits
+with status 1 if any did.
+"""
+
+import argparse
+import base64
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from block import Block, create_genesis_block  # noqa: E402
+from pow_engine import DivisibilityRule, HashTarget, MiningEngine  # noqa: E402
+from wallet import generate_ECDSA_keys, sign_ECDSA_msg  # noqa: E402
+import fake_firestore  # noqa: E402
+import validation  # noqa: E402
+import verify  # noqa: E402
+
+SEED = 1234
+GROUPS = ["crypto", "pow", "chain", "mempool", "api"]
+
+CHAIN_LENGTHS = [1000, 10000, 100000]
+MEMPOOL_SIZES = [1000, 10000, 50000]
+HISTORY_SIZES = [10, 100, 1000]
+QUICK_CHAIN_LENGTHS = [1000, 10000]
+QUICK_MEMPOOL_SIZES = [1000, 10000]
+QUICK_HISTORY_SIZES = [10, 100]
+
+
+def measure(operation, samples, number=1, setup=None, unit=1):
+    """Seconds per operation of each of samples timed runs.
+
+    Each run calls operation number times, after setup (untimed) if given.
+    unit is how many operations one call does, e.g. hashes per scan call.
+    """
+    operation()  # warm-up: caches, lazy imports, first-use pools
+    times = []
+    for _ in range(samples):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            operation()
+        times.append((time.perf_counter() - start) / (number * unit))
+    return times
+
+
+def summarize(times, params):
+    quantiles = statistics.quantiles(times, n=100) if len(times) > 1 else times * 99
+    mean = statistics.fmean(times)
+    # From the median sample, so one sample slowed down by another process
+    # doesn't move it
+    median = statistics.median(times)
+    return {
+        "params": params,
+        "samples": len(times),
+        "ops_per_sec": 1 / median if median else float("inf"),
+        "mean_ms": mean * 1000,
+        "p50_ms": quantiles[49] * 1000,
+        "p95_ms": quantiles[94] * 1000,
+        "p99_ms": quantiles[98] * 1000
+    }
+
+
+def result_key(name, params):
+    if not params:
+        return name
+    return f"{name}[{','.join(f'{k}={v}' for k, v in params.items())}]"
+
+
+class Runner:
+    def __init__(self, samples):
+        self.samples = samples
+        self.results = {}
+
+    def add(self, name, times, **params):
+        result = summarize(times, params)
+        key = result_key(name, params)
+        self.results[key] = result
+        print(f"{key:<52}{result['ops_per_sec']:>14,.1f}{result['p50_ms']:>11.3f}"
+              f"{result['p95_ms']:>11.3f}{result['p99_ms']:>11.3f}")
+
+
+def random_address(rng):
+    return base64.b64encode(rng.randbytes(64)).decode()
+
+
+def signed_transaction(rng):
+    private_key, public_key = generate_ECDSA_keys()
+    signature, message = sign_ECDSA_msg(private_key)
+    return {
+        "from": public_key,
+        "to": random_address(rng),
+        "amount": 1,
+        "signature": signature.decode(),
+        "message": message
+    }
+
+
+def bench_crypto(runner, rng, args):
+    txion = signed_transaction(rng)
+    reward = {"from": "network", "to": random_address(rng), "amount": 1}
+    for count in (1, 100):
+        block = Block(1, 1.0, {"proof-of-work": 71271, "transactions": [reward] + [txion] * (count - 1)},
+                      create_genesis_block().hash)
+
+        def hash_block(block=block):
+            # The merkle root is part of the work when a block is new
+            block.invalidate()
+            block.hash_block()
+        runner.add("block.hash_block", measure(hash_block, runner.samples, number=100), txs=count)
+
+    import miner
+    check = (txion["from"], txion["signature"], txion["message"])
+    runner.add("miner.validate_signature", measure(lambda: miner.validate_signature(*check), runner.samples,
+                                                   setup=verify.verifying_key.cache_clear), key_cache="cold")
+    runner.add("miner.validate_signature", measure(lambda: miner.validate_signature(*check), runner.samples,
+                                                   number=10), key_cache="warm")
+
+    runner.add("wallet.generate_ECDSA_keys", measure(generate_ECDSA_keys, runner.samples, number=10))
+    private_key = generate_ECDSA_keys()[0]
+    runner.add("wallet.sign_ECDSA_msg", measure(lambda: sign_ECDSA_msg(private_key), runner.samples, number=10))
+
+
+def bench_pow(runner, rng, args):
+    last_block = create_genesis_block()
+    candidate = Block(1, 1.0, {"proof-of-work": 0, "transactions": []}, last_block.hash)
+    scan = 10000
+
+    # A target no nonce meets, so every call scans all of its nonces
+    strategy = HashTarget(bits=128)
+    strategy.prepare(candidate)
+    prefix = candidate.header_prefix()
+    runner.add("pow.scan", measure(lambda: strategy.scan(last_block, prefix, 0, 1, scan),
+                                   runner.samples, unit=scan), rule="hash")
+    legacy = DivisibilityRule()
+    legacy_last = Block(0, 0.0, {"proof-of-work": 1 << 62, "transactions": []}, "0")
+    runner.add("pow.scan", measure(lambda: legacy.scan(legacy_last, b"", 1, 1, scan),
+                                   runner.samples, unit=scan), rule="legacy")
+
+    # A whole search, worker start-up included, on one worker so the result
+    # doesn't depend on the core count
+    for bits in (8, 12):
+        strategy = HashTarget(bits=bits)
+        engine = MiningEngine(strategy, workers=1)
+        blocks = iter(range(2, 10 ** 9))
+
+        def search():
+            block = Block(next(blocks), 1.0, {"transactions": []}, last_block.hash)
+            strategy.prepare(block)
+            with contextlib.redirect_stdout(io.StringIO()):
+                engine.search(last_block, block.header_prefix())
+        runner.add("pow.search", measure(search, max(3, runner.samples // 10)), bits=bits, workers=1)
+
+
+def chain_blocks(start, count, previous_hash, addresses):
+    """Blocks with a mining reward and one transfer between addresses. The
+    transfers aren't signed: they are only served and indexed, never
+    validated."""
+    blocks = []
+    for index in range(start, start + count):
+        sender = addresses[index % len(addresses)]
+        recipient = addresses[(index * 7 + 1) % len(addresses)]
+        data = {"difficulty": 0, "transactions": [
+            {"from": sender, "to": recipient, "amount": 1, "signature": f"sig-{index}", "message": "0"},
+            {"from": "network", "to": addresses[0], "amount": 1}
+        ]}
+        block = Block(index, float(index), data, previous_hash)
+        previous_hash = block.hash
+        blocks.append(block)
+    return blocks
+
+
+def bench_chain(runner, rng, args):
+    import miner
+    from balances import BalanceIndex
+    from mempool import Mempool
+
+    # A clean node with a new block store and no balance snapshot. store
+    # writes the blocks, as the mining process does.
+    miner.BLOCKSTORE_DIR = tempfile.mkdtemp(prefix="bench-chain-")
+    miner.BALANCES = BalanceIndex()
+    miner.MEMPOOL = Mempool()
+    miner.POW_STRATEGY = HashTarget(bits=0)
+    miner.load_chain()
+    store = miner.open_blockstore()
+    client = miner.node.test_client()
+    addresses = [random_address(rng) for _ in range(1000)]
+    reward = {"from": "network", "to": addresses[0], "amount": 1}
+    # A block may not repeat a transaction, so each new block gets its own
+    signed = [signed_transaction(rng) for _ in range(10)]
+    # The same chain in memory, for validate_chain()
+    chain = [create_genesis_block()]
+
+    for length in CHAIN_LENGTHS if not args.quick else QUICK_CHAIN_LENGTHS:
+        tip = chain[-1]
+        blocks = chain_blocks(tip.index + 1, length - len(chain), tip.hash, addresses)
+        store.extend(blocks)
+        miner.apply_chain_update(tip.index, blocks)
+        chain.extend(blocks)
+
+        def get(path, status=200):
+            response = client.get(path)
+            assert response.status_code == status, (path, response.status_code)
+            response.get_data()
+
+        since = chain[-11].hash
+        runner.add("miner.tip", measure(lambda: get("/tip"), runner.samples, number=10), length=length)
+        runner.add("miner.blocks_since", measure(lambda: get(f"/blocks?since_hash={since}"),
+                                                 runner.samples, number=10), length=length, new_blocks=10)
+        # A peer that forked five blocks back
+        locator = ",".join([os.urandom(32).hex() for _ in range(5)] + [b.hash for b in chain[-6::-1][:5]] +
+                           [chain[0].hash])
+        runner.add("miner.fork_point", measure(lambda: get(f"/blocks/fork-point?locator={locator}"),
+                                               runner.samples, number=10), length=length)
+        address = addresses[1]
+        runner.add("miner.balance", measure(lambda: get(f"/balance/{address}"),
+                                            runner.samples, number=10), length=length)
+        runner.add("miner.address_txs", measure(lambda: get(f"/address/{address}/txs?limit=20"),
+                                                runner.samples, number=10), length=length)
+
+        # A peer with ten more blocks, each with a signed transaction, parsed
+        # fresh from JSON: only the fork search and the new blocks are checked
+        suffix = []
+        previous_hash = chain[-1].hash
+        for txion in signed:
+            index = len(chain) + len(suffix)
+            suffix.append(Block(index, float(index), {"difficulty": 0, "transactions": [txion, reward]},
+                                previous_hash))
+            previous_hash = suffix[-1].hash
+        peer = chain + suffix
+
+        def forget_suffix():
+            for block in suffix:
+                block.invalidate()
+        runner.add("chain.validate_chain", measure(
+            lambda: validation.validate_chain(chain, peer, miner.POW_STRATEGY),
+            runner.samples, setup=forget_suffix), length=length, new_blocks=10)
+
+
+def bench_mempool(runner, rng, args):
+    from mempool import Mempool
+
+    senders = [random_address(rng) for _ in range(500)]
+
+    def transactions(count, offset):
+        return [{"from": senders[i % len(senders)], "to": senders[(i * 3) % len(senders)],
+                 "amount": 1, "signature": f"sig-{offset + i}", "message": "0"} for i in range(count)]
+
+    extra = transactions(runner.samples * 100 + 1, 10 ** 8)
+    for size in MEMPOOL_SIZES if not args.quick else QUICK_MEMPOOL_SIZES:
+        pool = Mempool(max_transactions=size)
+        for txion in transactions(size, 0):
+            pool.add(txion)
+
+        # A full pool: every add evicts the oldest transaction
+        pending = iter(extra)
+        runner.add("mempool.add", measure(lambda: pool.add(next(pending)), runner.samples, number=100),
+                   size=size)
+        runner.add("mempool.select", measure(lambda: pool.select(1000, 1024 * 1024), runner.samples),
+                   size=size)
+        runner.add("mempool.contains", measure(lambda: extra[-1] in pool, runner.samples, number=100),
+                   size=size)
+
+        batch = pool.select(1000, 1024 * 1024)
+
+        def refill():
+            for txion in batch:
+                pool.add(txion)
+        runner.add("mempool.remove_transactions", measure(lambda: pool.remove_transactions(batch),
+                                                          runner.samples, setup=refill),
+                   size=size, block_txs=len(batch))
+
+
+def seed_firestore(client, rng, history_sizes):
+    """Users with college ids and, for each history size, a user with that
+    many transactions in their feed."""
+    from firebase.firebase_code import college_id_key
+
+    words = ["ada", "alan", "grace", "linus", "barbara", "edsger", "donald", "ken", "dennis", "margaret"]
+    users = client.collection("users")
+    for i in range(1000):
+        uid = f"user-{i:04d}"
+        users.document(uid).set({
+            "uid": uid, "name": f"{rng.choice(words)} {rng.choice(words)}", "college_id": f"C{i:05d}",
+            "department": "CS", "role": "student", "balance": 50, "tx_count": 0, "feed": True
+        })
+        client.collection("college_ids").document(college_id_key(f"C{i:05d}")).set({"uid": uid, "name": f"user {i}"})
+
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    for size in history_sizes:
+        uid = f"history-{size}"
+        users.document(uid).set({
+            "uid": uid, "name": f"history {size}", "college_id": f"H{size}", "department": "CS",
+            "role": "student", "balance": 10 ** 9, "tx_count": size, "feed": True
+        })
+        batch = client.batch()
+        for n in range(size):
+            tx_id = f"{uid}-{n:06d}"
+            record = {"sender_uid": uid, "recipient_uid": "user-0000", "sender_name": uid,
+                      "recipient_name": "user 0", "amount": 1,
+                      "timestamp": start + datetime.timedelta(seconds=n)}
+            batch.set(client.collection("transactions").document(tx_id), record)
+            batch.set(users.document(uid).collection("feed").document(tx_id), {
+                **record, "tx_id": tx_id, "direction": "sent",
+                "counterparty_uid": "user-0000", "counterparty_name": "user 0"
+            })
+        batch.commit()
+
+
+def bench_api(runner, rng, args):
+    client = fake_firestore.install()
+    try:
+        import server
+        from firebase import firebase_code
+    except ImportError as e:
+        print(f"Skipping the api group, server.py can't be imported: {e}")
+        return
+
+    history_sizes = HISTORY_SIZES if not args.quick else QUICK_HISTORY_SIZES
+    seed_firestore(client, rng, history_sizes)
+    client.latency = args.firestore_latency_ms / 1000
+    app = server.app.test_client()
+
+    def get(path, uid, status=200):
+        response = app.get(path, headers={"Authorization": f"Bearer token-{uid}"})
+        assert response.status_code == status, (path, response.status_code, response.get_data())
+        response.get_data()
+
+    uid = f"history-{history_sizes[0]}"
+    runner.add("api.profile", measure(lambda: get("/profile", uid), runner.samples, number=10),
+               profile_cache="warm")
+    runner.add("api.profile", measure(lambda: get("/profile", uid), runner.samples,
+                                      setup=firebase_code.profile_cache.clear), profile_cache="cold")
+
+    for size in history_sizes:
+        runner.add("api.transactions", measure(lambda: get("/transactions?limit=20", f"history-{size}"),
+                                               runner.samples, number=5), history=size, limit=20)
+
+    def send():
+        response = app.post("/transactions/send", json={"recipientId": "C00001", "amount": 1},
+                            headers={"Authorization": f"Bearer token-{uid}"})
+        assert response.status_code == 200, response.get_data()
+    runner.add("api.transactions_send", measure(send, runner.samples, number=5))
+
+    runner.add("api.users_search", measure(lambda: get("/users/search?q=gr&limit=20", uid),
+                                           runner.samples, number=10), users=1000 + len(history_sizes))
+
+
+BENCHMARKS = {
+    "crypto": bench_crypto,
+    "pow": bench_pow,
+    "chain": bench_chain,
+    "mempool": bench_mempool,
+    "api": bench_api
+}
+
+
+def run(args):
+    runner = Runner(args.samples if args.samples else (20 if args.quick else 50))
+    print(f"{'benchmark':<52}{'ops/s':>14}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+    for group in args.group or GROUPS:
+        # Each group gets the same inputs whichever groups run before it
+        BENCHMARKS[group](runner, random.Random(f"{SEED}-{group}"), args)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "quick": args.quick,
+            "samples": runner.samples
+        },
+        "results": runner.results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+
+    regressions = 0
+    print(f"{'benchmark':<52}{'baseline ops/s':>16}{'current ops/s':>16}{'change':>9}{'p95 change':>12}")
+    for key in sorted(baseline.keys() & current.keys()):
+        before, after = baseline[key], current[key]
+        change = after["ops_per_sec"] / before["ops_per_sec"] - 1
+        p95_change = after["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        flag = ""
+        if change < -args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change > args.threshold:
+            flag = "  faster"
+        print(f"{key:<52}{before['ops_per_sec']:>16,.1f}{after['ops_per_sec']:>16,.1f}"
+              f"{change:>+9.1%}{p95_change:>+12.1%}{flag}")
+    for key in sorted(baseline.keys() - current.keys()):
+        print(f"{key:<52} missing from {args.current}")
+    for key in sorted(current.keys() - baseline.keys()):
+        print(f"{key:<52} new, not in {args.baseline}")
+
+    if regressions:
+        print(f"{regressions} benchmark(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+    print(f"No regressions beyond {args.threshold:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and save the results as JSON")
+    run_parser.add_argument("--group", choices=GROUPS, action="append", help="repeatable, default all")
+    run_parser.add_argument("--quick", action="store_true", help="smaller sizes and fewer samples")
+    run_parser.add_argument("--samples", type=int, help="timed samples per benchmark (default 50, quick 20)")
+    run_parser.add_argument("--firestore-latency-ms", type=float, default=0.0,
+                            help="delay added to every fake Firestore call")
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="compare results against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10,
+                                help="ops/sec drop that counts as a regression (default 0.10)")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
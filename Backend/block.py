@@ -0,0 +1,161 @@
+"""Blocks and their canonical binary header.
+
+A block's hash covers a fixed-layout header instead of Python reprs of its
+contents, so every node computes the same hash for the same block:
+
+    index          uint64
+    timestamp      float64
+    previous_hash  32 bytes
+    merkle_root    32 bytes, over the canonical JSON of each transaction
+    proof_hash     32 bytes, sha256 of the legacy proof of work in decimal
+                   (the proof at least doubles every block, so it outgrows
+                   any fixed-width integer)
+    difficulty     uint32, hash-target bits (0 when unused)
+    nonce          uint64
+
+All fields are little-endian. The header hash is computed once and cached,
+so checking a chain or a proof of work only re-hashes 124 bytes per block.
+"""
+
+import hashlib
+import json
+import struct
+
+HEADER_PREFIX = struct.Struct('<Qd32s32s32sI')
+NONCE = struct.Struct('<Q')
+EMPTY_HASH = bytes(32)
+
+# Fixed so that every node starts from the same genesis block hash
+GENESIS_TIMESTAMP = 0.0
+
+
+def nonce_bytes(nonce):
+    return NONCE.pack(nonce)
+
+
+def hash_bytes(hex_hash):
+    """32-byte form of a hex hash. The genesis block's "0" maps to zeros."""
+    if isinstance(hex_hash, str) and len(hex_hash) == 64:
+        return bytes.fromhex(hex_hash)
+    return EMPTY_HASH
+
+
+def serialize_transaction(txion):
+    """Canonical JSON of a transaction: sorted keys, no whitespace."""
+    return json.dumps(txion, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def merkle_root(transactions):
+    """Merkle root over the transactions' canonical JSON, duplicating the
+    last node of odd levels. No transactions gives 32 zero bytes.
+
+    Duplicating makes [a, b, c] and [a, b, c, c] share a root, so a valid
+    block never repeats a transaction (validation.validate_transactions).
+    """
+    if not transactions:
+        return EMPTY_HASH
+    level = [hashlib.sha256(serialize_transaction(t)).digest() for t in transactions]
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+    return level[0]
+
+
+class Block:
+    __slots__ = ('index', 'timestamp', 'data', 'previous_hash', 'nonce', '_merkle_root', '_hash')
+
+    def __init__(self, index, timestamp, data, previous_hash, nonce=0):
+        """Returns a new Block object. Each block is "chained" to its previous
+        by calling its unique hash.
+
+        Args:
+            index (int): Block number.
+            timestamp (float): Block creation timestamp.
+            data (dict): Proof of work fields and the block's transactions.
+            previous_hash(str): String representing previous block unique hash.
+            nonce (int): Proof of work nonce, used by hash-target mining.
+        """
+        self.index = index
+        self.timestamp = timestamp
+        self.data = data
+        self.previous_hash = previous_hash
+        self.nonce = nonce
+        self._merkle_root = None
+        self._hash = None
+
+    @property
+    def transactions(self):
+        return self.data.get('transactions') or []
+
+    @property
+    def merkle_root(self):
+        if self._merkle_root is None:
+            self._merkle_root = merkle_root(self.transactions)
+        return self._merkle_root
+
+    def header_prefix(self):
+        """The binary header without its nonce."""
+        return HEADER_PREFIX.pack(
+            self.index,
+            float(self.timestamp),
+            hash_bytes(self.previous_hash),
+            self.merkle_root,
+            hashlib.sha256(str(self.data.get('proof-of-work') or 0).encode('utf-8')).digest(),
+            self.data.get('difficulty') or 0
+        )
+
+    def header(self):
+        return self.header_prefix() + nonce_bytes(self.nonce)
+
+    def hash_block(self):
+        """Creates the unique hash for the block. It uses sha256 over the
+        binary header."""
+        return hashlib.sha256(self.header()).hexdigest()
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            self._hash = self.hash_block()
+        return self._hash
+
+    def invalidate(self):
+        """Forget cached hashes after changing the block's fields."""
+        self._merkle_root = None
+        self._hash = None
+
+    def to_dict(self):
+        """Convert block to dictionary for serialization"""
+        return {
+            'index': self.index,
+            'timestamp': self.timestamp,
+            'data': self.data,
+            'previous_hash': self.previous_hash,
+            'nonce': self.nonce,
+            'hash': self.hash
+        }
+
+    @staticmethod
+    def from_dict(block_dict, trusted=False):
+        """Create block from dictionary. trusted takes the dictionary's hash
+        instead of computing it; only for blocks this node already checked."""
+        block = Block(
+            block_dict['index'],
+            block_dict['timestamp'],
+            block_dict['data'],
+            block_dict['previous_hash'],
+            block_dict.get('nonce', 0)
+        )
+        if trusted:
+            block._hash = block_dict.get('hash')
+        return block
+
+
+def create_genesis_block():
+    """To create each block, it needs the hash of the previous one. First
+    block has no previous, so it must be created manually (with index zero
+     and arbitrary previous hash)"""
+    return Block(0, GENESIS_TIMESTAMP, {
+        "proof-of-work": 9,
+        "transactions": None},
+        "0")
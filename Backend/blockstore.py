@@ -0,0 +1,268 @@
+"""Append-only on-disk store of the node's blocks.
+
+Two files in the store directory:
+
+    blocks.dat  one record per block, back to back:
+                    length  uint32, of the payload
+                    crc32   uint32, of the payload
+                    payload the block's JSON (Block.to_dict(), with its hash)
+    blocks.idx  one uint64 per block, the offset of its record in
+                blocks.dat, read through mmap
+    blocks.hash one 32-byte hash per block, so a reader can map hashes to
+                indexes without parsing any block
+
+Reading block i costs one index lookup and one pread, so nothing has to be
+loaded at startup and the chain never has to fit in memory. Writes are
+fsynced in batches, the data file before the index, so after a crash the
+index can only be ahead of complete data by its torn last entries. Opening
+the store drops those and re-indexes any complete records written after the
+last index entry.
+
+One process writes the store. Others open it with readonly=True: that
+handle never recovers or writes, reads with pread only (a mapping would
+fault once the writer truncates the files), and serves as many blocks as
+its owner tells it with refresh().
+"""
+
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from block import Block
+from cache import TTLCache
+
+RECORD_HEADER = struct.Struct('<II')
+OFFSET = struct.Struct('<Q')
+HASH_SIZE = 32
+
+
+class BlockStore:
+    def __init__(self, directory, sync_every=256, sync_interval=1.0, readonly=False):
+        """Open (or create) the store in directory.
+
+        Args:
+            sync_every (int): Appended blocks after which the files are fsynced.
+            sync_interval (float): Seconds after which an append fsyncs the
+                files even if fewer than sync_every blocks are pending.
+            readonly (bool): Open another process's store to read it. The
+                handle starts with every block the index lists.
+        """
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.readonly = readonly
+        self._map = None
+        self._mapped = 0
+        self._pending = 0
+        self._last_sync = time.time()
+        # Recently read blocks, so the tip and nearby blocks keep their hashes
+        self._blocks = TTLCache(maxsize=1024)
+        if readonly:
+            self._data = os.open(os.path.join(directory, 'blocks.dat'), os.O_RDONLY)
+            self._index = os.open(os.path.join(directory, 'blocks.idx'), os.O_RDONLY)
+            self._hashes = os.open(os.path.join(directory, 'blocks.hash'), os.O_RDONLY)
+            self.reload()
+            return
+        os.makedirs(directory, exist_ok=True)
+        flags = os.O_RDWR | os.O_CREAT | os.O_APPEND
+        self._data = os.open(os.path.join(directory, 'blocks.dat'), flags, 0o644)
+        self._index = os.open(os.path.join(directory, 'blocks.idx'), flags, 0o644)
+        self._hashes = os.open(os.path.join(directory, 'blocks.hash'), flags, 0o644)
+        self._recover()
+
+    def _recover(self):
+        """Make the index and the data file agree after a crash."""
+        index_size = os.fstat(self._index).st_size
+        data_size = os.fstat(self._data).st_size
+        count = index_size // OFFSET.size
+
+        # Index entries whose record is torn or missing
+        while count and self._read_record(self._read_offset(count - 1), data_size) is None:
+            count -= 1
+        end = 0
+        if count:
+            offset = self._read_offset(count - 1)
+            end = offset + RECORD_HEADER.size + len(self._read_record(offset, data_size))
+        os.ftruncate(self._index, count * OFFSET.size)
+
+        # Complete records the index never got
+        recovered = 0
+        while True:
+            payload = self._read_record(end, data_size)
+            if payload is None:
+                break
+            os.write(self._index, OFFSET.pack(end))
+            end += RECORD_HEADER.size + len(payload)
+            recovered += 1
+        if end < data_size or recovered or count * OFFSET.size < index_size:
+            print(f"Block store recovered: {count + recovered} blocks, "
+                  f"{data_size - end} torn bytes dropped")
+        os.ftruncate(self._data, end)
+        self._size = end
+        self._count = count + recovered
+        self._remap()
+
+        # Hashes of blocks stored before blocks.hash existed, or lost with
+        # a crash. Only these records are parsed.
+        hashed = min(os.fstat(self._hashes).st_size // HASH_SIZE, self._count)
+        os.ftruncate(self._hashes, hashed * HASH_SIZE)
+        for i in range(hashed, self._count):
+            os.write(self._hashes, bytes.fromhex(json.loads(self.raw(i))['hash']))
+        if hashed < self._count:
+            print(f"Block store: hashed {self._count - hashed} blocks")
+        self.sync()
+
+    def _read_record(self, offset, data_size):
+        """Payload of the record at offset, or None if it is torn or corrupt."""
+        if offset + RECORD_HEADER.size > data_size:
+            return None
+        length, crc = RECORD_HEADER.unpack(os.pread(self._data, RECORD_HEADER.size, offset))
+        if offset + RECORD_HEADER.size + length > data_size:
+            return None
+        payload = os.pread(self._data, length, offset + RECORD_HEADER.size)
+        if zlib.crc32(payload) != crc:
+            return None
+        return payload
+
+    def _read_offset(self, i):
+        if self.readonly:
+            entry = os.pread(self._index, OFFSET.size, i * OFFSET.size)
+            if len(entry) < OFFSET.size:
+                raise IndexError("block was truncated by the writer")
+            return OFFSET.unpack(entry)[0]
+        if i >= self._mapped:
+            self._remap()
+        return OFFSET.unpack_from(self._map, i * OFFSET.size)[0]
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        size = os.fstat(self._index).st_size
+        self._mapped = size // OFFSET.size
+        if size:
+            self._map = mmap.mmap(self._index, size, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self._count
+
+    def _position(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("block index out of range")
+        return i
+
+    def raw(self, i):
+        """Serialized JSON of block i."""
+        i = self._position(i)
+        offset = self._read_offset(i)
+        if self.readonly:
+            payload = self._read_record(offset, os.fstat(self._data).st_size)
+            if payload is None:
+                raise IndexError("block was truncated by the writer")
+            return payload
+        length, _ = RECORD_HEADER.unpack(os.pread(self._data, RECORD_HEADER.size, offset))
+        return os.pread(self._data, length, offset + RECORD_HEADER.size)
+
+    def hash(self, i):
+        """Hash of block i, without reading the block."""
+        i = self._position(i)
+        digest = os.pread(self._hashes, HASH_SIZE, i * HASH_SIZE)
+        if len(digest) < HASH_SIZE:
+            raise IndexError("block was truncated by the writer")
+        return digest.hex()
+
+    def hashes(self, chunk=4096):
+        """Hash of every block, in order."""
+        for start in range(0, self._count, chunk):
+            size = min(chunk, self._count - start) * HASH_SIZE
+            digests = os.pread(self._hashes, size, start * HASH_SIZE)
+            for i in range(0, len(digests), HASH_SIZE):
+                yield digests[i:i + HASH_SIZE].hex()
+
+    def reload(self):
+        """Read-only handle: serve every block the writer has stored now,
+        e.g. to catch up after missing some of its updates."""
+        self._blocks.clear()
+        self._count = min(os.fstat(self._index).st_size // OFFSET.size,
+                          os.fstat(self._hashes).st_size // HASH_SIZE)
+
+    def refresh(self, fork, count):
+        """Read-only handle: serve the first count blocks, the writer having
+        replaced the ones after index fork."""
+        for i in range(fork + 1, self._count):
+            self._blocks.pop(i)
+        self._count = count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._count))]
+        i = self._position(i)
+        block = self._blocks.get(i)
+        if block is None:
+            block = Block.from_dict(json.loads(self.raw(i)), trusted=True)
+            self._blocks.set(i, block)
+        return block
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def append(self, block):
+        payload = json.dumps(block.to_dict(), separators=(',', ':')).encode()
+        os.write(self._data, RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        os.write(self._hashes, bytes.fromhex(block.hash))
+        os.write(self._index, OFFSET.pack(self._size))
+        self._size += RECORD_HEADER.size + len(payload)
+        self._blocks.set(self._count, block)
+        self._count += 1
+        self._pending += 1
+        if self._pending >= self.sync_every or time.time() - self._last_sync >= self.sync_interval:
+            self.sync()
+
+    def extend(self, blocks):
+        for block in blocks:
+            self.append(block)
+        self.sync()
+
+    def truncate(self, count):
+        """Keep only the first count blocks, e.g. to switch to a peer's fork."""
+        if count >= self._count:
+            return
+        end = self._read_offset(count)
+        # The mapping must not outlive the part of the file it covers
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._mapped = 0
+        # Data first: a crash in between leaves index entries past the end
+        # of the data, which recovery drops. The other way around, recovery
+        # would re-index the dropped blocks.
+        os.ftruncate(self._data, end)
+        os.ftruncate(self._index, count * OFFSET.size)
+        os.ftruncate(self._hashes, count * HASH_SIZE)
+        self._size = end
+        self._count = count
+        self._blocks.clear()
+        self.sync()
+
+    def sync(self):
+        """fsync the data file, then the index that points into it."""
+        os.fsync(self._data)
+        os.fsync(self._hashes)
+        os.fsync(self._index)
+        self._pending = 0
+        self._last_sync = time.time()
+
+    def close(self):
+        if not self.readonly:
+            self.sync()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        os.close(self._data)
+        os.close(self._index)
+        os.close(self._hashes)
@@ -0,0 +1,78 @@
+"""Small in-process caches used by the API server.
+
+Every gunicorn worker keeps its own copy, so anything cached here must be
+either safe to serve slightly stale (short TTL) or invalidated explicitly by
+the code path that changes it.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, maxsize, ttl=None):
+        """Bounded LRU cache where every entry can expire.
+
+        Args:
+            maxsize (int): Maximum number of entries kept. The least recently
+                used entry is dropped when it is exceeded.
+            ttl (float): Default lifetime of an entry in seconds. None means
+                entries only leave the cache through LRU eviction.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if it is missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        """Store value under key.
+
+        Args:
+            ttl (float): Lifetime for this entry, overrides the cache default.
+            expires_at (float): Absolute unix time at which the entry expires.
+                Takes precedence over any ttl.
+        """
+        if expires_at is None:
+            ttl = self.ttl if ttl is None else ttl
+            expires_at = None if ttl is None else time.time() + ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        """Remove key from the cache. Missing keys are ignored."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size, for monitoring."""
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses
+            }
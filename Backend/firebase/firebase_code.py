@@ -1,8 +1,13 @@
 import os
 import json
+import time
+import hashlib
 import firebase_admin
 from firebase_admin import credentials, auth, firestore
-import requests
+import http_client
+import metrics
+from cache import TTLCache
+from user_index import UserIndex, DISPLAY_FIELDS
 
 # --- SECURE INITIALIZATION ---
 base_path = os.path.dirname(__file__)
@@ -26,20 +31,74 @@ db = firestore.client()
 FIREBASE_WEB_API_KEY = os.environ["FIREBASE_WEB_API_KEY"]
 # ------------------------------
 
+# Decoded ID tokens, keyed by the token's sha256 digest. Each entry expires
+# at the token's own `exp` claim, so a cached token is never accepted longer
+# than Firebase itself would accept it.
+token_cache = TTLCache(maxsize=int(os.environ.get("TOKEN_CACHE_SIZE", 4096)))
+
+# User profiles read by login_required. Write paths in this process call
+# invalidate_user_profile(); the short TTL bounds how stale a profile changed
+# by another worker can be.
+profile_cache = TTLCache(
+    maxsize=int(os.environ.get("PROFILE_CACHE_SIZE", 4096)),
+    ttl=float(os.environ.get("PROFILE_CACHE_TTL", 5))
+)
+
+# Upper bound for an account's balance shards. Debits read every shard in
+# one transaction, so this also bounds their cost.
+MAX_BALANCE_SHARDS = 20
+
+# college_id -> {"uid", "name"} from the `college_ids` lookup index. The
+# mapping never changes once written, so entries are only evicted by LRU.
+college_id_cache = TTLCache(maxsize=int(os.environ.get("COLLEGE_ID_CACHE_SIZE", 8192)))
+
+# Time of each Firestore operation, and of the Firebase Auth calls, for
+# /metrics. A Firestore transaction is timed as one operation, retries
+# included; TRANSACTION_ATTEMPTS counts its attempts, so attempts above
+# the operation's call count are retries on contention.
+FIRESTORE_SECONDS = metrics.histogram("firestore_call_duration_seconds",
+                                      "Time of Firestore operations", ["op"])
+FIRESTORE_ERRORS = metrics.counter("firestore_call_errors_total", "Firestore operations that failed", ["op"])
+TRANSACTION_ATTEMPTS = metrics.counter("firestore_transaction_attempts_total",
+                                       "Attempts of Firestore transactions, retries included", ["op"])
+AUTH_SECONDS = metrics.histogram("firebase_auth_duration_seconds", "Time of Firebase Auth calls", ["op"])
+AUTH_ERRORS = metrics.counter("firebase_auth_errors_total", "Firebase Auth calls that failed", ["op"])
+
+
+def firestore_call(op):
+    """with firestore_call("op"): time the Firestore calls in the block."""
+    return FIRESTORE_SECONDS.time(errors=FIRESTORE_ERRORS, op=op)
+
+
+def auth_call(op):
+    return AUTH_SECONDS.time(errors=AUTH_ERRORS, op=op)
+
 
 # ============================
 # AUTH & USER FUNCTIONS
 # ============================
 
+def college_id_key(college_id):
+    """Document id of a college_id in the `college_ids` index. College ids
+    are user input, and one with a "/" or over Firestore's length limit
+    can't be a document id, so the index uses its sha256 instead."""
+    return hashlib.sha256(college_id.encode()).hexdigest()
+
+
 def create_user_with_profile(user_data):
     email = user_data["email"]
     password = user_data["password"]
+    college_id = user_data.get("college_id")
+    # Indexes profiles from before the index, so create() below sees them
+    if isinstance(college_id, str) and resolve_college_id(college_id):
+        raise ValueError("college_id is already taken")
 
     # Create Firebase Auth user
-    user = auth.create_user(
-        email=email,
-        password=password
-    )
+    with auth_call("create_user"):
+        user = auth.create_user(
+            email=email,
+            password=password
+        )
 
     uid = user.uid
 
@@ -47,13 +106,32 @@ def create_user_with_profile(user_data):
     user_data.pop("password", None)
     user_data["uid"] = uid
 
-    # Store profile in Firestore
-    db.collection("users").document(uid).set(user_data)
+    # Store the profile and its college_id lookup entry together. create()
+    # fails if the college_id is already taken, so it stays unique.
+    try:
+        batch = db.batch()
+        batch.set(db.collection("users").document(uid), user_data)
+        if isinstance(college_id, str) and college_id:
+            batch.create(db.collection("college_ids").document(college_id_key(college_id)), {
+                "uid": uid,
+                "name": user_data.get("name")
+            })
+        with firestore_call("create_user"):
+            batch.commit()
+    except Exception:
+        # Don't leave an Auth account behind without a profile
+        with auth_call("delete_user"):
+            auth.delete_user(uid)
+        raise
+    invalidate_user_profile(uid)
 
     return uid
 
 
 def login_user(email, password):
+    """Sign in with Identity Toolkit. Returns its response, or None for
+    wrong credentials. Raises requests.RequestException if it can't be
+    reached once http_client's retries run out."""
     url = (
         "https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword"
         f"?key={FIREBASE_WEB_API_KEY}"
@@ -65,31 +143,282 @@ def login_user(email, password):
         "returnSecureToken": True
     }
 
-    response = requests.post(url, json=payload)
+    response = http_client.post(url, json=payload)
     if response.status_code != 200:
         return None
 
     return response.json()
 
 
+def token_cache_key(id_token):
+    return hashlib.sha256(id_token.encode()).hexdigest()
+
+
 def verify_token(id_token):
-    try:
-        decoded = auth.verify_id_token(id_token)
+    key = token_cache_key(id_token)
+    decoded = token_cache.get(key)
+    if decoded is not None:
         return decoded
+
+    try:
+        with auth_call("verify_id_token"):
+            decoded = auth.verify_id_token(id_token)
     except Exception:
         return None
 
+    if decoded.get("exp", 0) > time.time():
+        token_cache.set(key, decoded, expires_at=decoded["exp"])
+    return decoded
+
+
+def get_user_profile(uid, use_cache=True):
+    if use_cache:
+        profile = profile_cache.get(uid)
+        if profile is not None:
+            return dict(profile)
+
+    user_ref = db.collection("users").document(uid)
+    with firestore_call("get_user_profile"):
+        doc = user_ref.get()
+        if not doc.exists:
+            return None
+        profile = doc.to_dict()
+        if profile.get("balance_shards"):
+            # Sharded accounts keep part of their balance in the shards
+            for shard in db.get_all(balance_shard_refs(user_ref, profile["balance_shards"])):
+                if shard.exists:
+                    shard_data = shard.to_dict()
+                    profile["balance"] += shard_data.get("balance", 0)
+                    profile["tx_count"] = profile.get("tx_count", 0) + shard_data.get("tx_count", 0)
+    profile_cache.set(uid, profile)
+    return dict(profile)
+
 
-def get_user_profile(uid):
-    doc = db.collection("users").document(uid).get()
-    if not doc.exists:
+def resolve_college_id(college_id):
+    """Map a college_id to {"uid", "name"} of its owner, or None.
+
+    Served from the in-process LRU cache when possible, otherwise from a point
+    read of `college_ids/{college_id_key(college_id)}`. Profiles created
+    before the index existed are found with the old query and indexed on
+    the way out. College ids are strings, so anything else has no owner.
+    """
+    if not isinstance(college_id, str):
         return None
-    return doc.to_dict()
+    entry = college_id_cache.get(college_id)
+    if entry is not None:
+        return entry
+
+    index_ref = db.collection("college_ids").document(college_id_key(college_id))
+    with firestore_call("resolve_college_id"):
+        doc = index_ref.get()
+        if doc.exists:
+            entry = doc.to_dict()
+        else:
+            query = db.collection("users").where("college_id", "==", college_id).limit(1)
+            user = next(iter(query.stream()), None)
+            if user is None:
+                return None
+            entry = {"uid": user.id, "name": user.get("name")}
+            index_ref.set(entry)
+
+    college_id_cache.set(college_id, entry)
+    return entry
+
+
+def resolve_college_ids(college_ids):
+    """Batched resolve_college_id(). Returns {college_id: {"uid", "name"}}
+    for every id that exists; unknown ids are left out.
+
+    Cache misses are fetched with one get_all() over the index, and ids that
+    are still missing with `in` queries over profiles (30 values per query).
+    """
+    resolved = {}
+    missing = []
+    for college_id in dict.fromkeys(c for c in college_ids if isinstance(c, str)):
+        entry = college_id_cache.get(college_id)
+        if entry is not None:
+            resolved[college_id] = entry
+        else:
+            missing.append(college_id)
+    if not missing:
+        return resolved
+
+    index = db.collection("college_ids")
+    with firestore_call("resolve_college_ids"):
+        keys = {college_id_key(college_id): college_id for college_id in missing}
+        for doc in db.get_all([index.document(key) for key in keys]):
+            if doc.exists:
+                resolved[keys[doc.id]] = doc.to_dict()
+                college_id_cache.set(keys[doc.id], resolved[keys[doc.id]])
+
+        unindexed = [college_id for college_id in missing if college_id not in resolved]
+        for i in range(0, len(unindexed), 30):
+            query = db.collection("users").where("college_id", "in", unindexed[i:i + 30])
+            for user in query.stream():
+                college_id = user.get("college_id")
+                entry = {"uid": user.id, "name": user.get("name")}
+                index.document(college_id_key(college_id)).set(entry)
+                resolved[college_id] = entry
+                college_id_cache.set(college_id, entry)
 
+    return resolved
 
-def get_all_users():
+
+def balance_shard_refs(user_ref, shards):
+    return [user_ref.collection("balance_shards").document(str(i)) for i in range(shards)]
+
+
+def enable_sharded_balance(uid, shards):
+    """Spread credits to this account over `shards` counter documents.
+
+    Meant for hot accounts (events, faculty) that receive many concurrent
+    credits. Reads sum the shards and debits fold them back into the profile.
+    """
+    if not 1 <= shards <= MAX_BALANCE_SHARDS:
+        raise ValueError(f"shards must be between 1 and {MAX_BALANCE_SHARDS}")
+    reshard_balance(uid, shards)
+
+
+def disable_sharded_balance(uid):
+    """Fold every balance shard back into the profile and stop sharding."""
+    reshard_balance(uid, 0)
+
+
+def reshard_balance(uid, shards):
+    """Fold every shard document the account has into its profile, then
+    start `shards` empty ones (none turns sharding off).
+
+    All documents under balance_shards are summed, not only the ones the
+    profile's current count names, so a credit that landed on any shard is
+    kept. Credits read balance_shards from the profile in their own
+    transaction, so none is made against the old count after this commits.
+    """
+    user_ref = db.collection("users").document(uid)
+
+    @firestore.transactional
+    def reshard(transaction):
+        TRANSACTION_ATTEMPTS.inc(op="reshard_balance")
+        profile = user_ref.get(transaction=transaction).to_dict()
+        existing = list(user_ref.collection("balance_shards").stream(transaction=transaction))
+        balance = profile["balance"]
+        tx_count = profile.get("tx_count", 0)
+        for shard in existing:
+            balance += shard.get("balance") or 0
+            tx_count += shard.get("tx_count") or 0
+        transaction.update(user_ref, {
+            "balance": balance,
+            "tx_count": tx_count,
+            "balance_shards": shards or firestore.DELETE_FIELD
+        })
+        shard_refs = balance_shard_refs(user_ref, shards)
+        kept = {shard_ref.id for shard_ref in shard_refs}
+        for shard in existing:
+            if shard.id not in kept:
+                transaction.delete(shard.reference)
+        for shard_ref in shard_refs:
+            transaction.set(shard_ref, {"balance": 0, "tx_count": 0})
+
+    with firestore_call("reshard_balance"):
+        reshard(db.transaction())
+    invalidate_user_profile(uid)
+
+
+def invalidate_user_profile(*uids):
+    """Drop cached profiles after a write that changes them."""
+    for uid in uids:
+        profile_cache.pop(uid)
+
+
+def cache_stats():
+    return {
+        "tokens": token_cache.stats(),
+        "profiles": profile_cache.stats(),
+        "college_ids": college_id_cache.stats()
+    }
+
+
+def cache_stat(field):
+    """cache_stats() field of every cache, as read by /metrics."""
+    return lambda: {(name,): stats[field] for name, stats in cache_stats().items()}
+
+
+metrics.counter("cache_hits_total", "Cache hits", ["cache"], function=cache_stat("hits"))
+metrics.counter("cache_misses_total", "Cache misses", ["cache"], function=cache_stat("misses"))
+metrics.gauge("cache_entries", "Entries in the cache", ["cache"], function=cache_stat("size"))
+
+
+def get_all_users(fields=DISPLAY_FIELDS, limit=100, after=None):
+    """One page of users ordered by uid, projected to `fields`.
+    Returns (users, uid to pass as `after` for the next page) or None."""
     try:
-        users = db.collection("users").stream()
-        return [{**doc.to_dict(), "uid": doc.id} for doc in users]
+        users_ref = db.collection("users")
+        query = users_ref.select(list(fields)).order_by("__name__")
+        if after:
+            query = query.start_after({"__name__": users_ref.document(after)})
+        with firestore_call("get_all_users"):
+            docs = list(query.limit(limit + 1).stream())
     except Exception:
         return None
+    next_after = docs[limit - 1].id if len(docs) > limit else None
+    return [{**doc.to_dict(), "uid": doc.id} for doc in docs[:limit]], next_after
+
+
+# Prefix index behind /users/search, started on first use in each worker
+user_index = UserIndex()
+
+
+def search_users(query, limit, after=None, exclude=None):
+    user_index.start(db.collection("users"))
+    return user_index.search(query, limit, after=after, exclude=exclude)
+
+
+def backfill_tx_counts():
+    """One-off migration for profiles created before `tx_count` existed.
+    Run it once while deploying, before those users send or receive again,
+    otherwise their first transaction starts the counter from zero.
+    """
+    for doc in db.collection("users").stream():
+        if "tx_count" in doc.to_dict():
+            continue
+        total = 0
+        for field in ("sender_uid", "recipient_uid"):
+            query = db.collection("transactions").where(field, "==", doc.id)
+            total += query.count().get()[0][0].value
+        doc.reference.update({"tx_count": total})
+
+
+def backfill_user_feeds():
+    """One-off migration that copies existing transactions into each
+    participant's `users/{uid}/feed` and flags the profile with `feed`, which
+    switches /transactions over to the feed for that user. Feed entries use
+    the transaction id, so re-running it is harmless.
+    """
+    users_ref = db.collection("users")
+    batch = db.batch()
+    pending = 0
+    for doc in db.collection("transactions").stream():
+        record = doc.to_dict()
+        entries = (
+            (record["sender_uid"], "sent", record["recipient_uid"], record.get("recipient_name")),
+            (record["recipient_uid"], "received", record["sender_uid"], record.get("sender_name"))
+        )
+        for uid, direction, counterparty_uid, counterparty_name in entries:
+            batch.set(users_ref.document(uid).collection("feed").document(doc.id), {
+                **record,
+                "tx_id": doc.id,
+                "direction": direction,
+                "counterparty_uid": counterparty_uid,
+                "counterparty_name": counterparty_name
+            })
+            pending += 1
+        # Firestore caps a batch at 500 writes
+        if pending >= 400:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+
+    for doc in users_ref.stream():
+        if not doc.to_dict().get("feed"):
+            doc.reference.update({"feed": True})
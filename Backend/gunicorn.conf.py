@@ -0,0 +1,9 @@
+"""Gunicorn settings, read from the working directory when server.py or
+asgi_server.py is served with `gunicorn`."""
+
+
+def post_fork(server, worker):
+    # Fill the signup keypair pool as soon as the worker boots, so its first
+    # signups don't generate keys on the request thread
+    from keypool import keypair_pool
+    keypair_pool.start()
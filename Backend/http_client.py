@@ -0,0 +1,110 @@
+"""Shared HTTP client for outbound calls (Identity Toolkit, miner nodes).
+
+Calls go through one keep-alive requests.Session per process, so repeated
+calls to the same host reuse their TCP/TLS connection. Every call has a
+connect/read timeout, 5xx responses and connection failures are retried
+with jittered exponential backoff, and the latency of each call is logged
+and aggregated per host for /metrics.
+
+Settings come from the environment:
+    HTTP_CONNECT_TIMEOUT  seconds, default 3
+    HTTP_READ_TIMEOUT     seconds, default 10
+    HTTP_RETRIES          extra attempts after the first, default 2
+    HTTP_POOL_SIZE        keep-alive connections per host, default 10
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3))
+READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 10))
+RETRIES = int(os.environ.get("HTTP_RETRIES", 2))
+POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 10))
+BACKOFF = 0.2
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_pid = None
+_lock = threading.Lock()
+
+CALL_SECONDS = metrics.histogram("http_client_request_duration_seconds",
+                                 "Time of outbound HTTP calls, by host", ["method", "host"])
+CALLS = metrics.counter("http_client_requests_total",
+                        "Outbound HTTP calls, by host and status code or error", ["method", "host", "outcome"])
+RETRIED = metrics.counter("http_client_retries_total", "Outbound HTTP calls sent again", ["method", "host"])
+
+
+def session():
+    """The process' pooled session. A forked child (the miner process)
+    gets its own instead of sharing the parent's sockets."""
+    global _session, _session_pid
+    with _lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session_pid = os.getpid()
+        return _session
+
+
+def request(method, url, timeout=None, retries=None, **kwargs):
+    """Send a request through the shared session.
+
+    Args:
+        timeout: A single number (used as the read timeout) or a
+            (connect, read) tuple. Defaults to the configured timeouts.
+        retries (int): Extra attempts on 5xx or connection errors.
+
+    Returns the last response, which can still be a 5xx once the retries
+    are used up. Connection errors and timeouts of the last attempt are
+    raised as usual requests exceptions.
+    """
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    elif not isinstance(timeout, tuple):
+        timeout = (min(CONNECT_TIMEOUT, timeout), timeout)
+    retries = RETRIES if retries is None else retries
+
+    for attempt in range(retries + 1):
+        start = time.perf_counter()
+        try:
+            response = session().request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            record(method, url, time.perf_counter() - start, type(e).__name__)
+            # A read timeout may mean the server acted on the request, so
+            # only requests that never got through are retried
+            if attempt == retries or isinstance(e, requests.ReadTimeout):
+                raise
+        else:
+            record(method, url, time.perf_counter() - start, response.status_code)
+            if response.status_code < 500 or attempt == retries:
+                return response
+        RETRIED.inc(method=method, host=urlsplit(url).netloc)
+        # Full jitter: sleep somewhere in [0, backoff * 2^attempt]
+        time.sleep(random.uniform(0, BACKOFF * 2 ** attempt))
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def record(method, url, elapsed, outcome):
+    host = urlsplit(url).netloc
+    logger.info("%s %s%s -> %s in %.1f ms", method, host, urlsplit(url).path, outcome, elapsed * 1000)
+    CALL_SECONDS.observe(elapsed, method=method, host=host)
+    CALLS.inc(method=method, host=host, outcome=outcome)
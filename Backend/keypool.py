@@ -0,0 +1,102 @@
+"""Pool of pre-generated wallet keypairs for /create-user.
+
+Signups take a ready [private_key, public_key] pair from the pool instead of
+generating one on the request thread. A background thread refills the pool
+whenever it drops to the low-water mark.
+
+If the optional `coincurve` package (libsecp256k1 bindings) is installed it
+generates the keys, which is fast enough to do on the filler thread. The
+pure-Python `ecdsa` fallback is CPU heavy, so the filler hands it to a
+separate process to keep it off the interpreter that serves requests.
+
+Settings come from the environment:
+    KEYPOOL_SIZE       pairs kept ready, default 64
+    KEYPOOL_LOW_WATER  refill once this many are left, default 16
+"""
+
+import base64
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from wallet import generate_ECDSA_keys
+
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
+KEYPOOL_SIZE = int(os.environ.get("KEYPOOL_SIZE", 64))
+KEYPOOL_LOW_WATER = int(os.environ.get("KEYPOOL_LOW_WATER", 16))
+
+
+def generate_keypair():
+    """Same format as wallet.generate_ECDSA_keys(): hex private key and the
+    base64 of the raw 64-byte SECP256k1 public key."""
+    if coincurve is None:
+        return generate_ECDSA_keys()
+    private_key = coincurve.PrivateKey()
+    # Uncompressed points start with a 0x04 prefix byte the wallet format omits
+    public_key = private_key.public_key.format(compressed=False)[1:]
+    return [private_key.secret.hex(), base64.b64encode(public_key).decode()]
+
+
+class KeypairPool:
+    def __init__(self, size=KEYPOOL_SIZE, low_water=KEYPOOL_LOW_WATER):
+        self.size = size
+        self.low_water = low_water
+        self._keys = queue.Queue(maxsize=size)
+        self._refill = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the filler thread once per process. gunicorn.conf.py calls
+        this in each worker after gunicorn forks it; take() calls it too for
+        servers started some other way."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._fill, name="keypool", daemon=True)
+                self._thread.start()
+                self._refill.set()
+
+    def take(self):
+        """Return a keypair, generating one inline only if the pool is empty."""
+        self.start()
+        try:
+            keys = self._keys.get_nowait()
+        except queue.Empty:
+            keys = generate_keypair()
+        if self._keys.qsize() <= self.low_water:
+            self._refill.set()
+        return keys
+
+    def _fill(self):
+        executor = ProcessPoolExecutor(max_workers=1) if coincurve is None else None
+        while True:
+            self._refill.wait()
+            self._refill.clear()
+            while not self._keys.full():
+                try:
+                    if executor is None:
+                        keys = generate_keypair()
+                    else:
+                        keys = executor.submit(generate_keypair).result()
+                    self._keys.put_nowait(keys)
+                except queue.Full:
+                    break
+                except Exception as e:
+                    print(f"Keypair pool refill error: {e}")
+                    break
+
+    def stats(self):
+        return {
+            "ready": self._keys.qsize(),
+            "size": self.size,
+            "low_water": self.low_water,
+            "backend": "ecdsa" if coincurve is None else "coincurve"
+        }
+
+
+keypair_pool = KeypairPool()
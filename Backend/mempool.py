@@ -0,0 +1,131 @@
+"""Pending transactions of a node.
+
+Transactions are keyed by a digest of (sender, signature), so the same
+signed transaction submitted to several nodes, or twice to one, is kept
+once. The pool is bounded by a transaction count, a byte total and a count
+per sender; when it is full the oldest transactions are evicted first.
+
+Mining takes a bounded batch in arrival order, which keeps each sender's
+transactions in the order they were sent. Transactions leave the pool when
+a block containing them is accepted, whoever mined it, and come back if
+that block is later dropped by a reorg. A transaction the chain already
+confirmed is not taken again, however late a copy of it arrives.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+
+from block import serialize_transaction
+
+ADDED = "added"
+DUPLICATE = "duplicate"
+CONFIRMED = "confirmed"
+SENDER_LIMIT = "sender limit"
+TOO_LARGE = "too large"
+
+
+def transaction_id(txion):
+    """Digest of the transaction's sender and signature."""
+    key = f"{txion.get('from')}\0{txion.get('signature')}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class Mempool:
+    def __init__(self, max_transactions=50000, max_bytes=32 * 1024 * 1024, max_per_sender=1000,
+                 is_confirmed=None):
+        """
+        Args:
+            is_confirmed (callable): Takes a transaction_id(), returns
+                whether the chain already has that transaction.
+        """
+        self.is_confirmed = is_confirmed
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+        self.max_per_sender = max_per_sender
+        self.evicted = 0
+        # id -> (transaction, serialized size), oldest first
+        self._entries = OrderedDict()
+        # sender -> ids of its pending transactions, oldest first
+        self._by_sender = defaultdict(OrderedDict)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, txion):
+        return transaction_id(txion) in self._entries
+
+    def add(self, txion):
+        """Add a transaction whose signature was already checked. Returns
+        ADDED, or why it was not: DUPLICATE, CONFIRMED, SENDER_LIMIT or
+        TOO_LARGE."""
+        txion_id = transaction_id(txion)
+        size = len(serialize_transaction(txion))
+        with self._lock:
+            if txion_id in self._entries:
+                return DUPLICATE
+            # Checked under the lock: a block that confirms it removes it
+            # from the pool only after the chain has it
+            if self.is_confirmed and self.is_confirmed(txion_id):
+                return CONFIRMED
+            if size > self.max_bytes:
+                return TOO_LARGE
+            if len(self._by_sender.get(txion['from'], ())) >= self.max_per_sender:
+                return SENDER_LIMIT
+            while self._entries and (len(self._entries) >= self.max_transactions
+                                     or self._bytes + size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evicted += 1
+            self._entries[txion_id] = (txion, size)
+            self._by_sender[txion['from']][txion_id] = None
+            self._bytes += size
+            return ADDED
+
+    def _remove(self, txion_id):
+        txion, size = self._entries.pop(txion_id)
+        sender_ids = self._by_sender[txion['from']]
+        sender_ids.pop(txion_id, None)
+        if not sender_ids:
+            del self._by_sender[txion['from']]
+        self._bytes -= size
+
+    def remove_transactions(self, txions):
+        """Drop the pending copies of transactions that made it into a block."""
+        with self._lock:
+            for txion in txions:
+                txion_id = transaction_id(txion)
+                if txion_id in self._entries:
+                    self._remove(txion_id)
+
+    def discard_confirmed(self):
+        """Drop the pending transactions the chain has confirmed, for when
+        the chain was reloaded instead of updated block by block."""
+        if not self.is_confirmed:
+            return
+        with self._lock:
+            for txion_id in [txion_id for txion_id in self._entries if self.is_confirmed(txion_id)]:
+                self._remove(txion_id)
+
+    def select(self, max_transactions, max_bytes):
+        """Oldest pending transactions that fit in a block. They stay in the
+        pool until a block with them is accepted."""
+        batch = []
+        total = 0
+        with self._lock:
+            for txion, size in self._entries.values():
+                if len(batch) >= max_transactions or total + size > max_bytes:
+                    break
+                batch.append(txion)
+                total += size
+        return batch
+
+    def stats(self):
+        with self._lock:
+            return {
+                "transactions": len(self._entries),
+                "bytes": self._bytes,
+                "senders": len(self._by_sender),
+                "evicted": self.evicted
+            }
@@ -0,0 +1,216 @@
+"""Process metrics in the Prometheus text format, served on /metrics.
+
+    REQUESTS = metrics.counter("app_requests_total", "Requests served", ["route"])
+    LATENCY = metrics.histogram("app_call_seconds", "Time of calls", ["op"])
+
+    REQUESTS.inc(route="/profile")
+    with LATENCY.time(op="get_profile"):
+        ...
+
+Updating a counter or a histogram is a dict lookup and an addition under a
+lock. Values that already live somewhere else (chain height, pool sizes,
+cache hit counts) are read by a function only when /metrics is scraped, so
+nothing extra happens while no one is looking.
+
+Every process keeps its own metrics: under gunicorn each worker reports its
+own, and the miner's mining process shares its numbers with the server
+process explicitly.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a cache hit to a slow remote call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_registry = {}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        """
+        Args:
+            labelnames (list): Names of the labels every update must pass.
+            function (callable): Read the values at scrape time instead:
+                returns a number, or {label values tuple: number}.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _read(self):
+        if self.function is None:
+            with _lock:
+                return dict(self._values)
+        values = self.function()
+        return values if isinstance(values, dict) else {(): values}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in sorted(self._read().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (not cumulative) plus +Inf, then sum
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, errors=None, **labels):
+        """Observe how long the with block takes. If it raises, the errors
+        Counter (with the same labels) is incremented too."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            if errors is not None:
+                errors.inc(**labels)
+            raise
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _read(self):
+        with _lock:
+            return {key: list(series) for key, series in self._values.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, series in sorted(self._read().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def _register(metric):
+    with _lock:
+        if metric.name in _registry:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        _registry[metric.name] = metric
+    return metric
+
+
+def counter(name, documentation, labelnames=(), function=None):
+    return _register(Counter(name, documentation, labelnames, function))
+
+
+def gauge(name, documentation, labelnames=(), function=None):
+    return _register(Gauge(name, documentation, labelnames, function))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render():
+    """Every registered metric in the Prometheus text format."""
+    with _lock:
+        registered = list(_registry.values())
+    lines = []
+    for metric in registered:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            # One broken gauge function shouldn't hide every other metric
+            print(f"Error reading metric {metric.name}: {e}")
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = histogram("http_request_duration_seconds", "Time to handle a request, by route",
+                            ["method", "route"])
+REQUESTS = counter("http_requests_total", "Requests handled, by route and status", ["method", "route", "status"])
+
+
+def instrument(app):
+    """Time every request of a Flask app by route and serve /metrics.
+
+    Routes are labelled by their rule (/balance/<path:address>), not the
+    URL, so the number of series stays bounded. A streamed response is
+    timed until its body starts.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        started = g.pop("request_started", None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route)
+            REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+        return response
+
+    @app.route("/metrics")
+    def serve_metrics():
+        return Response(render(), mimetype=None, content_type=CONTENT_TYPE)
+
+    return app
@@ -1,261 +1,565 @@
-import time
 import hashlib
+import os
+import queue
+import time
 import json
-import requests
-import base64
-from flask import Flask, request, jsonify
-from multiprocessing import Process, Queue
-import ecdsa
-
-from miner_config import MINER_ADDRESS, MINER_NODE_URL, PEER_NODES
+import threading
+from urllib.parse import urlparse
+from flask import Flask, Response, request, jsonify
+from multiprocessing import Process, Queue, Value
+
+import http_client
+import metrics
+import sync
+import verify
+from miner_config import (MINER_ADDRESS, MINER_NODE_URL, MINER_PUBLIC_URL, PEER_NODES,
+                          VERIFY_WORKERS, POW_MODE, POW_DIFFICULTY_BITS, POW_WORKERS, CONSENSUS_INTERVAL,
+                          BLOCKSTORE_DIR, BLOCKSTORE_SYNC_EVERY, MEMPOOL_MAX_TRANSACTIONS,
+                          MEMPOOL_MAX_BYTES, MEMPOOL_MAX_PER_SENDER, BLOCK_MAX_TRANSACTIONS,
+                          BLOCK_MAX_BYTES, BALANCE_SNAPSHOT_EVERY)
+from block import Block, create_genesis_block
+from balances import BalanceIndex, transaction_amount
+from blockstore import BlockStore
+from cache import TTLCache
+from mempool import Mempool, transaction_id, ADDED, DUPLICATE, CONFIRMED, SENDER_LIMIT
+from pow_engine import MiningEngine, strategy_from_config
 
 node = Flask(__name__)
+# Per-route latency histograms and GET /metrics
+metrics.instrument(node)
 
 
-class Block:
-    def __init__(self, index, timestamp, data, previous_hash):
-        """Returns a new Block object. Each block is "chained" to its previous
-        by calling its unique hash.
-
-        Args:
-            index (int): Block number.
-            timestamp (int): Block creation timestamp.
-            data (str): Data to be sent.
-            previous_hash(str): String representing previous block unique hash.
-        """
-        self.index = index
-        self.timestamp = timestamp
-        self.data = data
-        self.previous_hash = previous_hash
-        self.hash = self.hash_block()
-
-    def hash_block(self):
-        """Creates the unique hash for the block. It uses sha256."""
-        sha = hashlib.sha256()
-        sha.update((str(self.index) + str(self.timestamp) + str(self.data) + str(self.previous_hash)).encode('utf-8'))
-        return sha.hexdigest()
-
-    def to_dict(self):
-        """Convert block to dictionary for serialization"""
-        return {
-            'index': self.index,
-            'timestamp': self.timestamp,
-            'data': self.data,
-            'previous_hash': self.previous_hash,
-            'hash': self.hash
-        }
-
-    @staticmethod
-    def from_dict(block_dict):
-        """Create block from dictionary"""
-        block = Block(
-            block_dict['index'],
-            block_dict['timestamp'],
-            block_dict['data'],
-            block_dict['previous_hash']
-        )
-        return block
+# Node's blockchain copy: a read-only handle on the mining process's block
+# store, serving the blocks this process has applied. Opened by load_chain().
+BLOCKCHAIN = None
 
+# Block hash -> index in BLOCKCHAIN, to find fork points with syncing peers
+BLOCK_INDEX = {}
 
-def create_genesis_block():
-    """To create each block, it needs the hash of the previous one. First
-    block has no previous, so it must be created manually (with index zero
-     and arbitrary previous hash)"""
-    return Block(0, time.time(), {
-        "proof-of-work": 9,
-        "transactions": None},
-        "0")
+# Held while a chain update changes the blocks we serve and the balance
+# index, and by readers that need both to agree
+CHAIN_LOCK = threading.Lock()
 
+# Blocks per chunk of a streamed /blocks response
+STREAM_CHUNK = 1000
 
-# Node's blockchain copy
-BLOCKCHAIN = [create_genesis_block()]
+# Hashes of blocks announced by peers or to them, so gossip doesn't loop
+SEEN_BLOCKS = TTLCache(maxsize=10000, ttl=600)
 
-""" Stores the transactions that this node has in a list.
-If the node you sent the transaction adds a block
-it will get accepted, but there is a chance it gets
-discarded and your transaction goes back as if it was never
-processed"""
-NODE_PENDING_TRANSACTIONS = []
+# Seconds between checks for announced blocks while mining
+ANNOUNCE_POLL_INTERVAL = 0.5
 
+POW_STRATEGY = strategy_from_config(POW_MODE, POW_DIFFICULTY_BITS)
+
+""" Stores the transactions that this node has. If the node you sent the
+transaction adds a block it will get accepted, but there is a chance it gets
+discarded and your transaction goes back as if it was never processed"""
+MEMPOOL = Mempool(MEMPOOL_MAX_TRANSACTIONS, MEMPOOL_MAX_BYTES, MEMPOOL_MAX_PER_SENDER,
+                  is_confirmed=lambda txion_id: txion_id in BALANCES.confirmed)
+
+# Balance and transactions of every address in BLOCKCHAIN
+BALANCES = BalanceIndex(os.path.join(BLOCKSTORE_DIR, 'balances.json'), BALANCE_SNAPSHOT_EVERY)
+
+# Most transactions in one page of /address/<address>/txs
+MAX_PAGE_SIZE = 100
+
+# Chain updates that dropped blocks of ours, for /metrics
+REORGS = metrics.counter("miner_reorgs_total", "Chain updates that replaced some of our blocks")
+
+
+def announced_peers(announcements):
+    """Peers that announced a new block since the last call, each once."""
+    peers = []
+    while True:
+        try:
+            node_url = announcements.get_nowait()
+        except queue.Empty:
+            return peers
+        if node_url not in peers:
+            peers.append(node_url)
+
+
+def mining_stats():
+    """Numbers the mining process keeps in shared memory for the server
+    process's /metrics."""
+    return {name: Value('d', 0.0, lock=False)
+            for name in ("hash_rate", "hashes", "blocks_mined", "consensus_rounds", "consensus_seconds")}
+
+
+def proof_of_work(engine, candidate, blockchain, announcements, stats=None, confirmed=None):
+    """Search for the candidate block's proof of work on every core. As soon
+    as a peer announces a new block, the blocks we miss are fetched from it,
+    and every CONSENSUS_INTERVAL seconds all the other nodes are checked.
+    If any of them already has a chain with more work, the search stops
+    right away.
+
+    Returns (nonce, None), or (None, (fork, suffix)) when another node got
+    the proof first: its chain is ours up to index fork followed by suffix.
+    """
+    branches = []
+    last_consensus = time.time()
+
+    def poll():
+        nonlocal last_consensus
+        if stats:
+            stats["hash_rate"].value = engine.hash_rate()
+        peers = announced_peers(announcements)
+        if not peers:
+            if time.time() - last_consensus < CONSENSUS_INTERVAL:
+                return False
+            last_consensus = time.time()
+        # If any other node got the proof, stop searching
+        started = time.time()
+        branch = consensus(blockchain, peers or None, confirmed)
+        if stats:
+            stats["consensus_rounds"].value += 1
+            stats["consensus_seconds"].value += time.time() - started
+        if branch:
+            branches.append(branch)
+        return bool(branch)
+
+    nonce = engine.search(
+        blockchain[-1],
+        candidate.header_prefix(),
+        poll=poll,
+        poll_interval=ANNOUNCE_POLL_INTERVAL
+    )
+    if stats:
+        stats["hash_rate"].value = engine.last_hash_rate
+        stats["hashes"].value += engine.last_hashes
+    if nonce is None:
+        return None, branches[0] if branches else None
 
-def proof_of_work(last_proof, blockchain):
-    """Creates a variable that we will use to find our next proof of work"""
-    incrementer = last_proof + 1
-    start_time = time.time()
-    check_interval = 60
-    last_check = start_time
-    
-    while not (incrementer % 7919 == 0 and incrementer % last_proof == 0):
-        incrementer += 1
-        current_time = time.time()
-        
-        # Check if any node found the solution every 60 seconds
-        if current_time - last_check >= check_interval:
-            last_check = current_time
-            # If any other node got the proof, stop searching
-            new_blockchain = consensus(blockchain)
-            if new_blockchain:
-                # (False: another node got proof first, new blockchain)
-                return False, new_blockchain
-    
     # Once that number is found, we can return it as a proof of our work
-    return incrementer, blockchain
+    return nonce, None
 
 
-def mine(blockchain_queue, blockchain, node_pending_transactions):
+def fetch_pending_transactions():
+    """Load a block's worth of pending transactions from the node server"""
+    try:
+        response = http_client.get(
+            url=MINER_NODE_URL + '/txion',
+            params={'update': MINER_ADDRESS},
+            timeout=5
+        )
+        return response.json()
+    except Exception as e:
+        print(f"Error fetching transactions: {e}")
+        return []
+
+
+def open_blockstore():
+    """The node's block store, starting with the genesis block if it's new."""
+    store = BlockStore(BLOCKSTORE_DIR, sync_every=BLOCKSTORE_SYNC_EVERY)
+    if not len(store):
+        store.extend([create_genesis_block()])
+    return store
+
+
+def load_chain():
+    """Open the block store read-only and bring BLOCK_INDEX and the balance
+    index up to date with it. Only the store's hash file and the blocks
+    after the balance snapshot are read, not the whole chain."""
+    global BLOCKCHAIN
+    # Recovers the store after a crash, or starts a new one
+    open_blockstore().close()
+    BLOCKCHAIN = BlockStore(BLOCKSTORE_DIR, readonly=True)
+    reload_chain()
+
+
+def reload_chain():
+    """Serve every block the store has now, rebuilding BLOCK_INDEX and the
+    balance index from it. Also how we catch up when a chain update from
+    the mining process can't be applied."""
+    with CHAIN_LOCK:
+        BLOCKCHAIN.reload()
+        BLOCK_INDEX.clear()
+        BLOCK_INDEX.update((block_hash, i) for i, block_hash in enumerate(BLOCKCHAIN.hashes()))
+        BALANCES.load(BLOCKCHAIN)
+    MEMPOOL.discard_confirmed()
+
+
+def mine(blockchain_queue, announcements, stats=None):
     """Mining is the only way that new coins can be created.
     In order to prevent too many coins to be created, the process
     is slowed down by a proof of work algorithm.
+
+    The mining process owns the block store and reads from it only the
+    blocks it needs, starting with the tip. stats, from mining_stats(), is
+    updated for the server process's /metrics.
     """
-    BLOCKCHAIN = blockchain
-    NODE_PENDING_TRANSACTIONS = node_pending_transactions
+    BLOCKCHAIN = open_blockstore()
+    # Transactions our chain confirmed, to check peers' blocks against. It
+    # starts from the server process's snapshot, which that process saves.
+    chain_index = BalanceIndex(os.path.join(BLOCKSTORE_DIR, 'balances.json'), save=False)
+    chain_index.load(BLOCKCHAIN)
+    strategy = POW_STRATEGY
+    engine = MiningEngine(strategy, POW_WORKERS)
     
     while True:
         try:
-            # Get the last proof of work
             last_block = BLOCKCHAIN[-1]
-            last_proof = last_block.data['proof-of-work']
+            
+            # The block is assembled before searching because a hash target
+            # covers its whole header. Transactions stay in the server's pool
+            # until a block with them is accepted, so a search that was cut
+            # short gets them again. The server drops the transactions of our
+            # last block once it applies it, which can be after this fetch.
+            pending_transactions = [
+                txion for txion in fetch_pending_transactions()
+                if transaction_id(txion) not in chain_index.confirmed
+            ]
+            
+            # We reward the miner by adding a transaction
+            new_block_data = {
+                "transactions": pending_transactions + [{
+                    "from": "network",
+                    "to": MINER_ADDRESS,
+                    "amount": 1
+                }]
+            }
+            mined_block = Block(last_block.index + 1, time.time(), new_block_data, last_block.hash)
+            strategy.prepare(mined_block)
             
             # Find the proof of work for the current block being mined
-            proof = proof_of_work(last_proof, BLOCKCHAIN)
+            proof = proof_of_work(engine, mined_block, BLOCKCHAIN, announcements, stats,
+                                  confirmed=chain_index.confirmed)
             
             # If we didn't guess the proof, start mining again
-            if not proof[0]:
-                # Update blockchain and save it to file
-                BLOCKCHAIN = proof[1]
-                blockchain_queue.put([b.to_dict() for b in BLOCKCHAIN])
+            if proof[0] is None:
+                # Switch to the other node's chain and save it to disk
+                if proof[1]:
+                    fork, suffix = proof[1]
+                    # The server process rolls back the dropped blocks,
+                    # which are gone from the store once it sees the update
+                    dropped = BLOCKCHAIN[fork + 1:]
+                    BLOCKCHAIN.truncate(fork + 1)
+                    BLOCKCHAIN.extend(suffix)
+                    chain_index.apply_update(fork, dropped, suffix)
+                    blockchain_queue.put((fork, [b.to_dict() for b in suffix], [b.to_dict() for b in dropped]))
                 continue
             else:
-                # Once we find a valid proof of work, we know we can mine a block so
-                # we reward the miner by adding a transaction
-                try:
-                    # First we load all pending transactions sent to the node server
-                    response = requests.get(
-                        url=MINER_NODE_URL + '/txion',
-                        params={'update': MINER_ADDRESS},
-                        timeout=5
-                    )
-                    NODE_PENDING_TRANSACTIONS = response.json()
-                except Exception as e:
-                    print(f"Error fetching transactions: {e}")
-                    NODE_PENDING_TRANSACTIONS = []
-                
-                # Then we add the mining reward
-                NODE_PENDING_TRANSACTIONS.append({
-                    "from": "network",
-                    "to": MINER_ADDRESS,
-                    "amount": 1
-                })
-                
-                # Now we can gather the data needed to create the new block
-                new_block_data = {
-                    "proof-of-work": proof[0],
-                    "transactions": list(NODE_PENDING_TRANSACTIONS)
-                }
-                new_block_index = last_block.index + 1
-                new_block_timestamp = time.time()
-                last_block_hash = last_block.hash
-                
-                # Empty transaction list
-                NODE_PENDING_TRANSACTIONS = []
-                
-                # Now create the new block
-                mined_block = Block(new_block_index, new_block_timestamp, new_block_data, last_block_hash)
-                BLOCKCHAIN.append(mined_block)
+                # Once we find a valid proof of work, we know we can mine the block
+                strategy.seal(mined_block, proof[0])
+                BLOCKCHAIN.extend([mined_block])
+                chain_index.apply_update(last_block.index, [], [mined_block])
+                if stats:
+                    stats["blocks_mined"].value += 1
                 
                 # Let the client know this node mined a block
                 print(json.dumps({
-                    "index": new_block_index,
-                    "timestamp": str(new_block_timestamp),
-                    "data": new_block_data,
-                    "hash": last_block_hash
+                    "index": mined_block.index,
+                    "timestamp": str(mined_block.timestamp),
+                    "data": mined_block.data,
+                    "nonce": mined_block.nonce,
+                    "hash": mined_block.hash
                 }, sort_keys=True, indent=2))
                 
-                blockchain_queue.put([b.to_dict() for b in BLOCKCHAIN])
-                
-                try:
-                    requests.get(
-                        url=MINER_NODE_URL + '/blocks',
-                        params={'update': MINER_ADDRESS},
-                        timeout=5
-                    )
-                except Exception as e:
-                    print(f"Error notifying node: {e}")
+                # Let the server process know about the new block only
+                blockchain_queue.put((last_block.index, [mined_block.to_dict()], []))
                     
         except Exception as e:
             print(f"Mining error: {e}")
             time.sleep(1)
 
 
-def find_new_chains():
-    """Get the blockchains of every other node"""
-    other_chains = []
-    for node_url in PEER_NODES:
-        try:
-            # Get their chains using a GET request
-            response = requests.get(url=node_url + "/blocks", timeout=5)
-            block = response.json()
-            # Verify other node block is correct
-            validated = validate_blockchain(block)
-            if validated:
-                # Add it to our list
-                other_chains.append(block)
-        except Exception as e:
-            print(f"Error fetching chain from {node_url}: {e}")
-    return other_chains
-
-
-def consensus(blockchain):
-    """Get the blocks from other nodes"""
-    other_chains = find_new_chains()
-    # If our chain isn't longest, then we store the longest chain
-    BLOCKCHAIN = blockchain
-    longest_chain = BLOCKCHAIN
-    for chain in other_chains:
-        if len(longest_chain) < len(chain):
-            longest_chain = chain
-    # If the longest chain wasn't ours, then we set our chain to the longest
-    if longest_chain == BLOCKCHAIN:
+def find_new_chains(blockchain, peers=None, confirmed=None):
+    """Get the best chain among the other nodes (or just peers). Every peer
+    is asked for its tip at once, and only the best peer's blocks after our
+    common prefix are downloaded and checked. Returns a list with that chain
+    as a (fork, suffix) pair, or an empty list.
+    """
+    branch = sync.best_chain(peers or PEER_NODES, blockchain, POW_STRATEGY,
+                             executor=verify.executor(VERIFY_WORKERS), confirmed=confirmed)
+    return [branch] if branch else []
+
+
+def consensus(blockchain, peers=None, confirmed=None):
+    """Get the blocks from other nodes. confirmed maps the ids of our
+    chain's transactions to their block index."""
+    other_chains = find_new_chains(blockchain, peers, confirmed)
+    # If our chain doesn't have the most work, then we store the chain that does
+    best_work = sync.chain_work(blockchain, POW_STRATEGY)
+    best_chain = None
+    for fork, suffix in other_chains:
+        if best_work < sync.fork_work(fork, suffix, POW_STRATEGY):
+            best_work = sync.fork_work(fork, suffix, POW_STRATEGY)
+            best_chain = (fork, suffix)
+    # If the best chain wasn't ours, then we switch to it
+    if best_chain is None:
         # Keep searching for proof
         return False
     else:
         # Give up searching proof, update chain and start over again
-        BLOCKCHAIN = longest_chain
-        return BLOCKCHAIN
+        return best_chain
+
 
+def apply_chain_update(fork, blocks, dropped_blocks=()):
+    """Keep our blocks up to index fork and serve blocks after them, in
+    place of dropped_blocks. The mining process has already stored them.
 
-def validate_blockchain(block):
-    """Validate the submitted chain. If hashes are not correct, return false
-    block(str): json
+    The pending transactions and the balance index follow the change.
+    """
+    if dropped_blocks:
+        REORGS.inc()
+    with CHAIN_LOCK:
+        BALANCES.apply_update(fork, dropped_blocks, blocks)
+        set_blocks(fork, blocks, dropped_blocks)
+    # Transactions of blocks a reorg drops are pending again, unless the
+    # new blocks have them too: the pool doesn't take confirmed ones
+    for block in dropped_blocks:
+        for txion in block.transactions:
+            if txion.get('from') != "network":
+                MEMPOOL.add(txion)
+    for block in blocks:
+        MEMPOOL.remove_transactions(block.transactions)
+
+
+def set_blocks(fork, blocks, dropped_blocks=()):
+    """The part of apply_chain_update() that replaces the blocks we serve."""
+    for block in dropped_blocks:
+        BLOCK_INDEX.pop(block.hash, None)
+    for block in blocks:
+        BLOCK_INDEX[block.hash] = block.index
+    BLOCKCHAIN.refresh(fork, fork + 1 + len(blocks))
+
+
+def apply_chain_updates(blockchain_queue):
+    """Apply the mining process's chain updates as they arrive. Each one is
+    (fork, block dicts, dropped block dicts): the blocks to put after our
+    block at index fork in place of the dropped ones. The mining process
+    already checked them, so their hashes are reused.
     """
-    return True
+    while True:
+        fork, block_dicts, dropped_dicts = blockchain_queue.get()
+        try:
+            blocks = [Block.from_dict(b, trusted=True) for b in block_dicts]
+            dropped = [Block.from_dict(b, trusted=True) for b in dropped_dicts]
+            # The store may already hold later updates, so the update is
+            # checked against the hashes we serve rather than its blocks
+            tip = len(BLOCKCHAIN) - 1
+            replaced_tip = dropped[-1].hash if dropped else blocks[0].previous_hash
+            if fork + len(dropped) != tip or BLOCK_INDEX.get(replaced_tip) != tip:
+                if BLOCK_INDEX.get(blocks[-1].hash) == blocks[-1].index:
+                    # Already read from the store by a reload
+                    continue
+                print(f"Chain update at {fork} does not fit our chain of {len(BLOCKCHAIN)} blocks, "
+                      f"reloading it from the block store")
+                reload_chain()
+                continue
+            apply_chain_update(fork, blocks, dropped)
+            announce_tip()
+        except Exception as e:
+            # A half-applied update would make every later one not fit
+            print(f"Error applying chain update: {e}, reloading the chain from the block store")
+            try:
+                reload_chain()
+            except Exception as e:
+                print(f"Error reloading the chain: {e}")
+
+
+def announce_tip():
+    """Tell the other nodes about our new tip, so they stop mining on an old
+    one without waiting for their next consensus round."""
+    chain = BLOCKCHAIN
+    tip = chain[-1]
+    SEEN_BLOCKS.set(tip.hash, True)
+    sync.announce(PEER_NODES, {
+        "node": MINER_PUBLIC_URL or MINER_NODE_URL,
+        "hash": tip.hash,
+        "index": tip.index,
+        "previous_hash": tip.previous_hash,
+        "header": tip.header().hex(),
+        "work": sync.chain_work(chain, POW_STRATEGY)
+    })
+
+
+def announcing_peer(node_url, remote_addr):
+    """The PEER_NODES url to fetch an announced block from: the url the
+    announcement names, or else the peer whose host sent it (a node whose
+    MINER_PUBLIC_URL isn't set names itself by its localhost url). None if
+    the sender is not one of our peers."""
+    peers = [peer.rstrip('/') for peer in PEER_NODES]
+    if node_url in peers:
+        return node_url
+    return next((peer for peer in peers if urlparse(peer).hostname == remote_addr), None)
+
+
+@node.route('/blocks/announce', methods=['POST'])
+def announce_block():
+    """A peer mined or accepted a block. If it is new to us and its chain
+    has more work, the mining process stops its search and fetches the
+    blocks it is missing from that peer.
+    """
+    header = request.get_json()
+    try:
+        block_hash = header['hash']
+        node_url = header['node'].rstrip('/')
+        work = int(header['work'])
+        valid_header = hashlib.sha256(bytes.fromhex(header['header'])).hexdigest() == block_hash
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return jsonify({"message": "Malformed announcement"}), 400
+    if not valid_header:
+        return jsonify({"message": "Header does not match its hash"}), 400
+    node_url = announcing_peer(node_url, request.remote_addr)
+    if node_url is None:
+        return jsonify({"message": "Unknown node"}), 403
+
+    # Each block is acted on once, however many peers announce it
+    if SEEN_BLOCKS.get(block_hash) or block_hash in BLOCK_INDEX:
+        return jsonify({"status": "seen"})
+    SEEN_BLOCKS.set(block_hash, True)
+    if work <= sync.chain_work(BLOCKCHAIN, POW_STRATEGY):
+        return jsonify({"status": "stale"})
+    announcement_queue.put(node_url)
+    return jsonify({"status": "accepted"})
+
+
+def stream_blocks(chain, start, end):
+    """Yield a JSON array of blocks start to end as stored, a chunk at a time"""
+    yield b"["
+    for i in range(start, end + 1, STREAM_CHUNK):
+        if i > start:
+            yield b","
+        yield b",".join(chain.raw(j) for j in range(i, min(i + STREAM_CHUNK, end + 1)))
+    yield b"]"
 
 
 @node.route('/blocks', methods=['GET'])
 def get_blocks():
-    """Load current blockchain. Only you should update your blockchain"""
-    global BLOCKCHAIN
-    
-    if request.args.get("update") == MINER_ADDRESS:
-        # Check if there's an update from the mining process
-        if not blockchain_queue.empty():
-            blockchain_dicts = blockchain_queue.get()
-            BLOCKCHAIN = [Block.from_dict(b) for b in blockchain_dicts]
-    
-    chain_to_send = BLOCKCHAIN
-    # Converts our blocks into dictionaries so we can send them as json objects later
-    chain_to_send_json = []
-    for block in chain_to_send:
-        block_dict = {
-            "index": str(block.index),
-            "timestamp": str(block.timestamp),
-            "data": str(block.data),
-            "hash": block.hash
-        }
-        chain_to_send_json.append(block_dict)
+    """Load current blockchain, read from the block store. The mining
+    process updates it through blockchain_queue.
+
+    Query parameters select a range of blocks:
+        from         first block index to send (default 0)
+        to           last block index to send (default the tip)
+        since_hash   send the blocks after the one with this hash
+
+    The ETag is the tip hash, so If-None-Match gets a 304 until the chain
+    changes.
+    """
+    chain = BLOCKCHAIN
+    # Read once: the chain can grow while the response streams
+    tip = len(chain) - 1
+    tip_hash = chain.hash(tip)
+    if request.if_none_match.contains(tip_hash):
+        response = Response(status=304)
+        response.set_etag(tip_hash)
+        return response
+
+    start = request.args.get("from", default=0, type=int)
+    end = request.args.get("to", default=tip, type=int)
+    since_hash = request.args.get("since_hash")
+    if since_hash is not None:
+        if since_hash not in BLOCK_INDEX:
+            return jsonify({"message": "Unknown block hash"}), 404
+        start = max(start, BLOCK_INDEX[since_hash] + 1)
+    start, end = max(start, 0), min(end, tip)
 
     # Send our chain to whomever requested it
-    return jsonify(chain_to_send_json)
+    response = Response(stream_blocks(chain, start, end), mimetype='application/json')
+    response.set_etag(tip_hash)
+    return response
+
+
+@node.route('/tip', methods=['GET'])
+def get_tip():
+    """Summary of our chain that peers compare before downloading blocks"""
+    chain = BLOCKCHAIN
+    return jsonify({
+        "height": chain[-1].index,
+        "hash": chain[-1].hash,
+        "work": sync.chain_work(chain, POW_STRATEGY)
+    })
+
+
+@node.route('/blocks/fork-point', methods=['GET'])
+def get_fork_point():
+    """Find the last block we share with a peer from its block locator
+    (comma-separated hashes, newest first)"""
+    locator = request.args.get("locator", "").split(",")
+    fork = sync.locate_fork(BLOCKCHAIN, BLOCK_INDEX, locator)
+    if fork is None:
+        return jsonify({"message": "No common block"}), 404
+    return jsonify({"index": fork[0], "hash": fork[1]})
+
+
+@node.route('/balance/<path:address>', methods=['GET'])
+def get_balance(address):
+    """Balance and transaction count of an address"""
+    balance, tx_count = BALANCES.balance(address)
+    return jsonify({
+        "address": address,
+        "balance": balance,
+        "tx_count": tx_count,
+        "height": BALANCES.height
+    })
+
+
+@node.route('/address/<path:address>/txs', methods=['GET'])
+def get_address_transactions(address):
+    """Transactions of an address, newest first. ?cursor= is the next_cursor
+    of the previous page."""
+    limit = min(max(request.args.get("limit", default=20, type=int), 1), MAX_PAGE_SIZE)
+    cursor = request.args.get("cursor")
+    try:
+        cursor = None if cursor is None else int(cursor)
+    except ValueError:
+        return jsonify({"message": "Invalid cursor"}), 400
+
+    # The refs and the blocks they point into must come from the same chain
+    with CHAIN_LOCK:
+        refs, next_cursor = BALANCES.transaction_refs(address, before=cursor, limit=limit)
+        blocks = []
+        for block_index, position in refs:
+            try:
+                blocks.append((BLOCKCHAIN[block_index], position))
+            except IndexError:
+                # The mining process is rewriting this part of the store
+                continue
+    txions = []
+    for block, position in blocks:
+        # A reorg the mining process has stored but we haven't applied yet
+        # can already show in the store
+        if BLOCK_INDEX.get(block.hash) != block.index:
+            continue
+        txion = block.transactions[position]
+        txions.append({
+            "block": block.index,
+            "block_hash": block.hash,
+            "timestamp": block.timestamp,
+            "from": txion.get('from'),
+            "to": txion.get('to'),
+            "amount": transaction_amount(txion)
+        })
+    return jsonify({
+        "transactions": txions,
+        "next_cursor": None if next_cursor is None else str(next_cursor)
+    })
+
+
+def log_transaction(txion):
+    # Because the transaction was successfully submitted, we log it to our console
+    print("New transaction")
+    print("FROM: {0}".format(txion['from']))
+    print("TO: {0}".format(txion['to']))
+    print("AMOUNT: {0}\n".format(txion['amount']))
+
+
+def add_transaction(txion):
+    """Put a transaction with a valid signature in the pool. Returns the
+    message for the client, or None if it was added."""
+    result = MEMPOOL.add(txion)
+    if result == ADDED:
+        log_transaction(txion)
+        return None
+    if result == DUPLICATE:
+        return "Transaction already pending"
+    if result == CONFIRMED:
+        return "Transaction already in the chain"
+    if result == SENDER_LIMIT:
+        return "Too many pending transactions from this address"
+    return "Transaction too large"
 
 
 @node.route('/txion', methods=['GET', 'POST'])
@@ -264,29 +568,66 @@ def transaction():
     Then it waits to be added to the blockchain. Transactions only move
     coins, they don't create it.
     """
-    global NODE_PENDING_TRANSACTIONS
-    
     if request.method == 'POST':
         # On each new POST request, we extract the transaction data
         new_txion = request.get_json()
-        # Then we add the transaction to our list
-        if validate_signature(new_txion['from'], new_txion['signature'], new_txion['message']):
-            NODE_PENDING_TRANSACTIONS.append(new_txion)
-            # Because the transaction was successfully submitted, we log it to our console
-            print("New transaction")
-            print("FROM: {0}".format(new_txion['from']))
-            print("TO: {0}".format(new_txion['to']))
-            print("AMOUNT: {0}\n".format(new_txion['amount']))
+        if not isinstance(new_txion, dict) or 'from' not in new_txion:
+            return "Transaction submission failed. Malformed transaction\n", 400
+        # A transaction we already have doesn't need its signature checked
+        if new_txion in MEMPOOL:
+            return "Transaction already pending\n"
+        # Then we add the transaction to our pool. The signature is checked in
+        # the verification pool, so concurrent requests use every core.
+        if verify.verify_async(new_txion).result():
+            error = add_transaction(new_txion)
+            if error:
+                return f"Transaction submission failed. {error}\n"
             # Then we let the client know it worked out
             return "Transaction submission successful\n"
         else:
             return "Transaction submission failed. Wrong signature\n"
-    # Send pending transactions to the mining process
+    # Send a block's worth of pending transactions to the mining process
     elif request.method == 'GET' and request.args.get("update") == MINER_ADDRESS:
-        pending = NODE_PENDING_TRANSACTIONS.copy()
-        # Empty transaction list
-        NODE_PENDING_TRANSACTIONS = []
-        return jsonify(pending)
+        return jsonify(MEMPOOL.select(BLOCK_MAX_TRANSACTIONS, BLOCK_MAX_BYTES))
+
+
+@node.route('/txion/batch', methods=['POST'])
+def transaction_batch():
+    """Submit a list of transactions at once. Their signatures are verified
+    in parallel and each one is accepted or rejected on its own.
+    """
+    txions = request.get_json()
+    if not isinstance(txions, list):
+        return jsonify({"message": "Expected a list of transactions"}), 400
+
+    # Only new, well-formed transactions need their signatures checked
+    new_txions = [t for t in txions if isinstance(t, dict) and 'from' in t and t not in MEMPOOL]
+    valid = dict(zip(map(id, new_txions), verify.verify_many(new_txions)))
+
+    results = []
+    for txion in txions:
+        if not isinstance(txion, dict) or 'from' not in txion:
+            results.append({"accepted": False, "signature": None, "error": "Malformed transaction"})
+            continue
+        if id(txion) not in valid:
+            error = "Transaction already pending"
+        elif not valid[id(txion)]:
+            error = "Wrong signature"
+        else:
+            error = add_transaction(txion)
+        result = {"accepted": error is None, "signature": txion.get('signature')}
+        if error:
+            result["error"] = error
+        results.append(result)
+    return jsonify({
+        "accepted": sum(1 for r in results if r["accepted"]),
+        "results": results
+    })
+
+
+@node.route('/txion/stats', methods=['GET'])
+def transaction_stats():
+    return jsonify(MEMPOOL.stats())
 
 
 def validate_signature(public_key, signature, message):
@@ -294,14 +635,7 @@ def validate_signature(public_key, signature, message):
     it's you (and not someone else) trying to do a transaction with your
     address. Called when a user tries to submit a new transaction.
     """
-    try:
-        public_key_decoded = (base64.b64decode(public_key)).hex()
-        signature_decoded = base64.b64decode(signature)
-        vk = ecdsa.VerifyingKey.from_string(bytes.fromhex(public_key_decoded), curve=ecdsa.SECP256k1)
-        return vk.verify(signature_decoded, message.encode())
-    except Exception as e:
-        print(f"Signature validation error: {e}")
-        return False
+    return verify.verify_signature(public_key, signature, message)
 
 
 def welcome_msg():
@@ -319,20 +653,60 @@ def welcome_msg():
 # Global queue for blockchain updates
 blockchain_queue = None
 
+# Global queue of peers that announced a block, read by the mining process
+announcement_queue = None
+
+# The mining process's mining_stats(), shared with this process for /metrics
+MINING_STATS = None
+
+
+def mining_stat(name):
+    return lambda: {} if MINING_STATS is None else MINING_STATS[name].value
+
+
+# Read when /metrics is scraped, nothing is updated per block or request
+metrics.gauge("miner_chain_height", "Index of our tip block", function=lambda: len(BLOCKCHAIN) - 1)
+metrics.gauge("miner_mempool_transactions", "Pending transactions", function=lambda: len(MEMPOOL))
+metrics.gauge("miner_mempool_bytes", "Serialized size of the pending transactions",
+              function=lambda: MEMPOOL.stats()["bytes"])
+metrics.counter("miner_mempool_evicted_total", "Pending transactions evicted from a full pool",
+                function=lambda: MEMPOOL.evicted)
+metrics.gauge("miner_hash_rate", "Hashes per second of the current proof-of-work search",
+              function=mining_stat("hash_rate"))
+metrics.counter("miner_hashes_total", "Proof-of-work hashes computed", function=mining_stat("hashes"))
+metrics.counter("miner_blocks_mined_total", "Blocks this node mined", function=mining_stat("blocks_mined"))
+metrics.counter("miner_consensus_rounds_total", "Consensus rounds run by the mining process",
+                function=mining_stat("consensus_rounds"))
+metrics.counter("miner_consensus_seconds_total", "Time spent in consensus rounds",
+                function=mining_stat("consensus_seconds"))
+
 
 if __name__ == '__main__':
     welcome_msg()
     
     # Create queue for communication between processes
     blockchain_queue = Queue()
+    announcement_queue = Queue()
+    MINING_STATS = mining_stats()
     
+    # Serve the chain saved on disk. The mining process is the store's
+    # only writer, this process reads it through a read-only handle.
+    load_chain()
+    print(f"Loaded {len(BLOCKCHAIN)} blocks from {BLOCKSTORE_DIR}")
+
     # Start mining process
     miner_process = Process(
         target=mine,
-        args=(blockchain_queue, BLOCKCHAIN, NODE_PENDING_TRANSACTIONS)
+        args=(blockchain_queue, announcement_queue, MINING_STATS)
     )
     miner_process.start()
+
+    # Apply the mining process's chain updates in the background
+    threading.Thread(target=apply_chain_updates, args=(blockchain_queue,), daemon=True).start()
     
+    # Start the signature verification workers before serving requests
+    verify.executor(VERIFY_WORKERS)
+
     # Start Flask server in the main process
     try:
         node.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
@@ -8,6 +8,46 @@ MINER_ADDRESS = "q3nf394hjg-random-miner-address-34nf3i4nflkn3oi"
 # Write your node url or ip. If you are running it localhost use default
 MINER_NODE_URL = "http://localhost:5000"
 
+# The url the other nodes reach this node at, exactly as it appears in
+# their PEER_NODES. Block announcements name this node by it, and peers
+# ignore announcements from urls they don't list. None uses MINER_NODE_URL,
+# which only works if that is not a localhost url.
+MINER_PUBLIC_URL = None
+
 # Store the url data of every other node in the network
 # so that we can communicate with them
 PEER_NODES = []
+
+# Processes used to verify transaction signatures. None uses every core
+VERIFY_WORKERS = None
+
+# Proof of work rule: "legacy" (proof divisible by 7919 and by the previous
+# proof) or "hash" (block hash below a target of POW_DIFFICULTY_BITS leading
+# zero bits). Every node of a network must use the same rule.
+POW_MODE = "legacy"
+POW_DIFFICULTY_BITS = 20
+
+# Processes searching for the proof of work. None uses every core
+POW_WORKERS = None
+
+# Seconds between checks of the other nodes' chains while mining
+CONSENSUS_INTERVAL = 10
+
+# Directory of the node's block store, so a restarted node keeps its chain
+BLOCKSTORE_DIR = "chaindata"
+
+# Blocks appended between fsyncs of the block store while syncing
+BLOCKSTORE_SYNC_EVERY = 256
+
+# Limits of the pool of pending transactions. When it is full the oldest
+# transactions are dropped first.
+MEMPOOL_MAX_TRANSACTIONS = 50000
+MEMPOOL_MAX_BYTES = 32 * 1024 * 1024
+MEMPOOL_MAX_PER_SENDER = 1000
+
+# Most transactions, and their total JSON size, put in one mined block
+BLOCK_MAX_TRANSACTIONS = 1000
+BLOCK_MAX_BYTES = 1024 * 1024
+
+# Blocks between snapshots of the address balance index
+BALANCE_SNAPSHOT_EVERY = 100
@@ -0,0 +1,201 @@
+"""Multi-core proof-of-work search.
+
+The nonce space is split across worker processes (worker k tries
+start + k, start + k + W, ...). All of them stop as soon as one finds a
+solution or the search is aborted, for example because a peer produced the
+next block first.
+
+What counts as a solution is a pluggable strategy:
+    DivisibilityRule  the original SimpleCoin rule, the proof must be
+                      divisible by 7919 and by the previous block's proof
+    HashTarget        the block header hash, as an integer, must be below
+                      2 ** (256 - bits)
+"""
+
+import hashlib
+import multiprocessing
+import os
+import queue
+import time
+
+from block import nonce_bytes
+
+# Nonces a worker tries between checks of the stop flag
+BATCH = 20000
+
+
+class DivisibilityRule:
+    name = "legacy"
+
+    def __init__(self, modulus=7919):
+        self.modulus = modulus
+
+    def prepare(self, block):
+        """Set what the block must carry before its header is searched."""
+
+    def seal(self, block, nonce):
+        """Store a found nonce in the block. This rule's proof lives in data."""
+        block.data['proof-of-work'] = nonce
+        block.invalidate()
+
+    def first_nonce(self, last_block):
+        return last_block.data['proof-of-work'] + 1
+
+    def scan(self, last_block, header_prefix, start, step, count):
+        last_proof = last_block.data['proof-of-work']
+        modulus = self.modulus
+        for nonce in range(start, start + step * count, step):
+            if nonce % modulus == 0 and nonce % last_proof == 0:
+                return nonce
+        return None
+
+    def is_valid(self, block, previous_block):
+        proof = block.data.get('proof-of-work')
+        last_proof = previous_block.data.get('proof-of-work')
+        # The proof must grow (searches start above the last one), or a
+        # chain could repeat one proof forever without searching at all
+        return (type(proof) is int and type(last_proof) is int and last_proof > 0
+                and proof > last_proof and proof % self.modulus == 0 and proof % last_proof == 0)
+
+    def work(self, block):
+        """Work a block adds to its chain: every block counts the same."""
+        return 1
+
+
+class HashTarget:
+    name = "hash"
+
+    def __init__(self, bits=20):
+        self.bits = bits
+        self.target = 1 << (256 - bits)
+
+    def prepare(self, block):
+        # The header commits to its difficulty, so it is set before searching
+        block.data['difficulty'] = self.bits
+        block.invalidate()
+
+    def seal(self, block, nonce):
+        block.nonce = nonce
+        block.invalidate()
+
+    def first_nonce(self, last_block):
+        return 0
+
+    def scan(self, last_block, header_prefix, start, step, count):
+        # The header prefix is hashed once; each nonce only costs a copy of
+        # that state plus 8 bytes
+        hasher = hashlib.sha256(header_prefix)
+        target = self.target
+        for nonce in range(start, start + step * count, step):
+            sha = hasher.copy()
+            sha.update(nonce_bytes(nonce))
+            if int.from_bytes(sha.digest(), 'big') < target:
+                return nonce
+        return None
+
+    def is_valid(self, block, previous_block):
+        return block.data.get('difficulty') == self.bits and int(block.hash, 16) < self.target
+
+    def work(self, block):
+        return 2 ** self.bits
+
+
+def strategy_from_config(mode, bits):
+    if mode == HashTarget.name:
+        return HashTarget(bits)
+    return DivisibilityRule()
+
+
+def _worker(strategy, last_block, header_prefix, start, step, stop, found, hashes, slot):
+    nonce = start
+    while not stop.is_set():
+        result = strategy.scan(last_block, header_prefix, nonce, step, BATCH)
+        hashes[slot] += BATCH
+        if result is not None:
+            found.put(result)
+            stop.set()
+            return
+        nonce += step * BATCH
+
+
+class MiningEngine:
+    def __init__(self, strategy, workers=None):
+        self.strategy = strategy
+        self.workers = workers or os.cpu_count() or 1
+        self.last_hash_rate = 0.0
+        self.last_hashes = 0
+        self._hashes = None
+        self._started = None
+
+    def search(self, last_block, header_prefix=b"", poll=None, poll_interval=60):
+        """Search for a nonce on top of last_block.
+
+        Args:
+            header_prefix (bytes): Serialized header of the candidate block
+                without its nonce. Only hash-based strategies use it.
+            poll (callable): Called every poll_interval seconds while
+                searching; a truthy result aborts the search.
+
+        Returns the nonce found, or None if the search was aborted.
+        """
+        aborted = False
+        stop = multiprocessing.Event()
+        found = multiprocessing.Queue()
+        hashes = multiprocessing.Array('Q', self.workers, lock=False)
+        self._hashes = hashes
+        start = self.strategy.first_nonce(last_block)
+        processes = [
+            multiprocessing.Process(
+                target=_worker,
+                args=(self.strategy, last_block, header_prefix, start + k, self.workers, stop, found, hashes, k),
+                daemon=True
+            )
+            for k in range(self.workers)
+        ]
+        started = self._started = time.time()
+        last_poll = started
+        for process in processes:
+            process.start()
+
+        nonce = None
+        try:
+            while nonce is None and not stop.is_set():
+                try:
+                    nonce = found.get(timeout=0.5)
+                except queue.Empty:
+                    pass
+                if nonce is None and poll and time.time() - last_poll >= poll_interval:
+                    last_poll = time.time()
+                    if poll():
+                        aborted = True
+                        break
+            if nonce is None and not aborted:
+                # A worker may have set the flag right after queueing its result
+                try:
+                    nonce = found.get(timeout=0.5)
+                except queue.Empty:
+                    pass
+        finally:
+            stop.set()
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            self._hashes = None
+
+        elapsed = max(time.time() - started, 1e-9)
+        self.last_hashes = sum(hashes)
+        self.last_hash_rate = self.last_hashes / elapsed
+        print(f"Proof of work: {self.last_hashes} hashes in {elapsed:.1f}s "
+              f"({self.last_hash_rate:,.0f} H/s, {self.workers} workers)")
+        # An aborted search may still have raced to a result; it's for a
+        # tip that is no longer ours, so drop it
+        return None if aborted else nonce
+
+    def hash_rate(self):
+        """Hashes per second of the running search so far, or of the last
+        one between searches."""
+        hashes = self._hashes
+        if hashes is None:
+            return self.last_hash_rate
+        return sum(hashes) / max(time.time() - self._started, 1e-9)
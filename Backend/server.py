@@ -1,13 +1,38 @@
 from flask import Flask, request, g, jsonify
-from firebase.firebase_code import create_user_with_profile, login_user, verify_token, get_user_profile, db, get_all_users
+from firebase.firebase_code import create_user_with_profile, login_user, verify_token, get_user_profile, db, get_all_users, search_users, invalidate_user_profile, resolve_college_id, resolve_college_ids, balance_shard_refs, MAX_BALANCE_SHARDS, cache_stats, firestore_call, TRANSACTION_ATTEMPTS
 from firebase_admin import firestore
-from wallet import generate_ECDSA_keys
+from keypool import keypair_pool
+from user_index import DISPLAY_FIELDS
 from functools import wraps
+import base64
 import datetime
+import heapq
+import itertools
+import json
+import random
+import requests
+import metrics
 from flask_cors import CORS
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "https://campuscred-b4e19.web.app"}})
+# Per-route latency histograms and GET /metrics
+metrics.instrument(app)
+metrics.gauge("keypool_ready", "Keypairs ready for signups", function=lambda: keypair_pool.stats()["ready"])
+
+MAX_PAGE_SIZE = 100
+
+# Profile fields /users may return; private_key and password never leave
+PUBLIC_USER_FIELDS = DISPLAY_FIELDS + ("email", "public_key")
+
+# A batch award debits the sender once (plus resetting its balance shards) and,
+# per recipient, writes the balance, the transaction record and two feed
+# entries. Firestore caps a commit at 500 writes, so awards are committed in
+# chunks that stay under it.
+MAX_BATCH_ITEMS = 1000
+WRITES_PER_AWARD = 4
+AWARDS_PER_COMMIT = (500 - 1 - MAX_BALANCE_SHARDS) // WRITES_PER_AWARD
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -46,7 +71,7 @@ def create_user():
   if not data:
       return {"message": "JSON body required"}, 400
 
-  keys = generate_ECDSA_keys()
+  keys = keypair_pool.take()
   
   initial_balance = 50
   
@@ -59,7 +84,9 @@ def create_user():
     "department": data.get('department'),
     "public_key": keys[1],
     "private_key": keys[0],
-    "balance": initial_balance
+    "balance": initial_balance,
+    "tx_count": 0,
+    "feed": True
   }
   
   try:
@@ -83,7 +110,13 @@ def login():
     if not email or not password:
         return {"message": "Email and password required"}, 400
 
-    result = login_user(email, password)
+    try:
+        result = login_user(email, password)
+    except requests.RequestException:
+        # Identity Toolkit is down or slow; the password may well be right.
+        # http_client has already logged the failure and counted it in
+        # http_client_requests_total
+        return jsonify({"message": "Login is unavailable, try again later"}), 503
 
     if not result:
         return {"message": "Invalid credentials"}, 401
@@ -103,287 +136,468 @@ def profile():
 @app.route("/users")
 @login_required
 def users():
-    users = get_all_users()
-    if users is None:
+    fields = request.args.get('fields')
+    fields = tuple(fields.split(',')) if fields else DISPLAY_FIELDS
+    if not set(fields) <= set(PUBLIC_USER_FIELDS):
+        return jsonify({"message": f"fields must be among {', '.join(PUBLIC_USER_FIELDS)}"}), 400
+    limit = min(max(request.args.get('limit', MAX_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+
+    page = get_all_users(fields, limit, request.args.get('cursor'))
+    if page is None:
         return jsonify({"message": "Failed to retrieve users"}), 500
-    return jsonify(users)
-
-@firestore.transactional
-
-def update_balances_transactional(transaction, sender_ref, recipient_ref, amount, sender_uid, recipient_uid, sender_name, recipient_name):
-
-    sender_snapshot = sender_ref.get(transaction=transaction)
-
-    current_balance = sender_snapshot.get('balance')
-
+    users, next_cursor = page
+    return jsonify({"users": users, "next_cursor": next_cursor})
 
+@app.route("/users/search")
+@login_required
+def users_search():
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_PAGE_SIZE)
+    try:
+        after = decode_search_cursor(request.args.get('cursor'))
+    except (ValueError, TypeError):
+        return jsonify({"message": "Invalid cursor"}), 400
 
-    if current_balance < amount:
+    users, position = search_users(query, limit, after=after, exclude=g.user['uid'])
+    return jsonify({"users": users, "next_cursor": encode_search_cursor(position)})
 
+@app.route("/cache-stats")
+@login_required
+def get_cache_stats():
+    return jsonify({**cache_stats(), "keypool": keypair_pool.stats()})
+
+def debit_balance(transaction, user_ref, amount, tx_count=1):
+    """Take amount from a user inside a transaction, enforcing the balance.
+
+    For sharded accounts every shard is read in the same transaction and
+    folded back into the main document, so the check sees the full balance
+    and a concurrent credit to any shard makes the transaction retry.
+    Must run before the transaction's first write.
+    """
+    snapshot = user_ref.get(transaction=transaction)
+    balance = snapshot.get('balance')
+    shards = []
+    if snapshot.to_dict().get('balance_shards'):
+        shard_refs = balance_shard_refs(user_ref, snapshot.get('balance_shards'))
+        shards = [shard for shard in db.get_all(shard_refs, transaction=transaction) if shard.exists]
+    balance += sum(shard.get('balance') or 0 for shard in shards)
+    tx_count += sum(shard.to_dict().get('tx_count', 0) for shard in shards)
+
+    if balance < amount:
         raise Exception("Insufficient funds")
 
-
-
-    # Update balances
-
-    transaction.update(sender_ref, {'balance': current_balance - amount})
-
-    transaction.update(recipient_ref, {'balance': firestore.Increment(amount)})
-
-
-
-    # Record the transaction
-
-    transaction.set(db.collection('transactions').document(), {
-
+    transaction.update(user_ref, {
+        'balance': balance - amount,
+        'tx_count': firestore.Increment(tx_count)
+    })
+    for shard in shards:
+        transaction.set(shard.reference, {'balance': 0, 'tx_count': 0})
+
+
+def read_balance_shards(transaction, user_refs):
+    """{uid: balance_shards} of each user, read inside the transaction.
+
+    A credit must go by the shard count the profile has when the credit
+    commits: a cached count can be stale after sharding is turned off or
+    changed, and credits to shards nobody reads any more are lost. Reading
+    the profile here makes a concurrent reshard and the credit retry
+    against each other instead. Must run before the transaction's first
+    write.
+    """
+    return {
+        snapshot.id: snapshot.get('balance_shards') or 0
+        for snapshot in db.get_all(user_refs, transaction=transaction)
+    }
+
+
+def credit_balance(transaction, user_ref, amount, tx_count=1, shards=0):
+    """Add amount to a user inside a transaction without reading it.
+
+    Sharded accounts take the credit on a random shard so concurrent
+    credits don't all contend on the user document. shards comes from
+    read_balance_shards() in the same transaction.
+    """
+    update = {'balance': firestore.Increment(amount)}
+    if tx_count:
+        update['tx_count'] = firestore.Increment(tx_count)
+
+    if shards:
+        transaction.set(random.choice(balance_shard_refs(user_ref, shards)), update, merge=True)
+    else:
+        transaction.update(user_ref, update)
+
+
+def record_transfer(transaction, sender_uid, recipient_uid, sender_name, recipient_name, amount, client=db):
+    """Write the transaction record and both participants' feed entries.
+
+    The global `transactions` document and the two `users/{uid}/feed`
+    entries share one id, so a feed entry always points back at its record.
+    client is the Firestore client the transaction belongs to.
+    """
+    tx_ref = client.collection('transactions').document()
+    record = {
         'sender_uid': sender_uid,
-
         'recipient_uid': recipient_uid,
-
         'sender_name': sender_name,
-
         'recipient_name': recipient_name,
-
         'amount': amount,
-
         'timestamp': datetime.datetime.now(datetime.timezone.utc)
-
+    }
+    transaction.set(tx_ref, record)
+
+    users_ref = client.collection('users')
+    transaction.set(users_ref.document(sender_uid).collection('feed').document(tx_ref.id), {
+        **record,
+        'tx_id': tx_ref.id,
+        'direction': 'sent',
+        'counterparty_uid': recipient_uid,
+        'counterparty_name': recipient_name
     })
+    transaction.set(users_ref.document(recipient_uid).collection('feed').document(tx_ref.id), {
+        **record,
+        'tx_id': tx_ref.id,
+        'direction': 'received',
+        'counterparty_uid': sender_uid,
+        'counterparty_name': sender_name
+    })
+    return tx_ref.id
 
 
+@firestore.transactional
+def update_balances_transactional(transaction, sender_ref, recipient_ref, amount, sender_uid, recipient_uid, sender_name, recipient_name):
+    TRANSACTION_ATTEMPTS.inc(op="update_balances")
+    # Every read comes before the first write
+    recipient_shards = read_balance_shards(transaction, [recipient_ref])[recipient_ref.id]
 
-@app.route("/transactions/send", methods=["POST"])
+    # Update balances
+    debit_balance(transaction, sender_ref, amount)
+    credit_balance(transaction, recipient_ref, amount, shards=recipient_shards)
 
-@login_required
+    # Record the transaction in the global collection and in both feeds
+    record_transfer(transaction, sender_uid, recipient_uid, sender_name, recipient_name, amount)
 
-def send_transaction():
 
+@app.route("/transactions/send", methods=["POST"])
+@login_required
+def send_transaction():
     data = request.get_json()
-
     recipient_college_id = data.get('recipientId')
-
     amount = data.get('amount')
 
-
-
     if not recipient_college_id or not amount:
-
         return jsonify({"message": "Recipient ID and amount are required"}), 400
 
-
-
     try:
-
         amount = int(amount)
-
         if amount <= 0:
-
             raise ValueError("Amount must be positive")
-
     except (ValueError, TypeError):
-
         return jsonify({"message": "Invalid amount"}), 400
 
-
-
     sender_uid = g.user['uid']
-
     sender_balance = g.user['balance']
 
-
-
     if sender_balance < amount:
-
         return jsonify({"message": "Insufficient funds"}), 400
 
-
-
     # Find recipient
-
-    users_ref = db.collection('users')
-
-    recipient_query = users_ref.where('college_id', '==', recipient_college_id).limit(1).stream()
-
-    
-
-    recipient = None
-
-    for r in recipient_query:
-
-        recipient = r
-
-        break
-
-    
-
+    recipient = resolve_college_id(recipient_college_id)
     if not recipient:
-
         return jsonify({"message": "Recipient not found"}), 404
 
-
-
-    recipient_data = recipient.to_dict()
-
-    recipient_uid = recipient.id
-
-
+    recipient_uid = recipient['uid']
 
     if sender_uid == recipient_uid:
-
         return jsonify({"message": "Cannot send credits to yourself"}), 400
 
-
-
     try:
-
         transaction = db.transaction()
-
+        users_ref = db.collection('users')
         sender_ref = users_ref.document(sender_uid)
-
         recipient_ref = users_ref.document(recipient_uid)
 
-        
+        with firestore_call("update_balances"):
+            update_balances_transactional(
+                transaction,
+                sender_ref,
+                recipient_ref,
+                amount,
+                sender_uid,
+                recipient_uid,
+                g.user['name'],
+                recipient['name']
+            )
+
+        invalidate_user_profile(sender_uid, recipient_uid)
+        return jsonify({"message": "Transaction successful"}), 200
+    except Exception as e:
+        # The cached balance may have been stale, make the next request re-read it
+        invalidate_user_profile(sender_uid)
+        return jsonify({"message": f"Transaction failed: {e}"}), 500
 
-        update_balances_transactional(
 
-            transaction, 
+@firestore.transactional
+def award_chunk_transactional(transaction, sender_ref, sender_uid, sender_name, awards):
+    """Debit the sender once for a chunk of awards and credit every recipient."""
+    TRANSACTION_ATTEMPTS.inc(op="award_chunk")
+    total = sum(award['amount'] for award in awards)
+    users_ref = db.collection('users')
+    # A recipient may appear more than once, so sum their credits first and
+    # write each recipient a single time.
+    credits = {}
+    for award in awards:
+        amount, count = credits.get(award['uid'], (0, 0))
+        credits[award['uid']] = (amount + award['amount'], count + 1)
+    # Every read comes before the first write
+    shards = read_balance_shards(transaction, [users_ref.document(uid) for uid in credits])
+
+    debit_balance(transaction, sender_ref, total, tx_count=len(awards))
+    for uid, (amount, count) in credits.items():
+        credit_balance(transaction, users_ref.document(uid), amount, tx_count=count, shards=shards[uid])
+
+    for award in awards:
+        record_transfer(transaction, sender_uid, award['uid'], sender_name, award['name'], award['amount'])
+
+
+def award_batch(user, items):
+    """Send every (recipientId, amount) item from user. Returns the response
+    body and status code; shared by the Flask and ASGI apps."""
+    if not isinstance(items, list) or not items:
+        return {"message": "A non-empty items list is required"}, 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return {"message": f"At most {MAX_BATCH_ITEMS} items per batch"}, 400
+
+    sender_uid = user['uid']
+    results = []
+    for item in items:
+        item = item if isinstance(item, dict) else {}
+        result = {"recipientId": item.get('recipientId'), "amount": item.get('amount')}
+        try:
+            result["amount"] = int(result["amount"])
+            if result["amount"] <= 0:
+                raise ValueError("Amount must be positive")
+            if not result["recipientId"]:
+                raise ValueError("Recipient ID is required")
+            if not isinstance(result["recipientId"], str):
+                raise ValueError("Recipient ID must be a string")
+        except (ValueError, TypeError) as e:
+            result.update(status="failed", message=f"Invalid item: {e}")
+        results.append(result)
+
+    # Resolve every recipient with one batched lookup
+    pending = [r for r in results if "status" not in r]
+    recipients = resolve_college_ids([r["recipientId"] for r in pending])
+    for result in pending:
+        recipient = recipients.get(result["recipientId"])
+        if not recipient:
+            result.update(status="failed", message="Recipient not found")
+        elif recipient['uid'] == sender_uid:
+            result.update(status="failed", message="Cannot send credits to yourself")
+        else:
+            result["recipient"] = recipient
+
+    awards = [r for r in results if "status" not in r]
+    if sum(r["amount"] for r in awards) > user['balance']:
+        return {"message": "Insufficient funds"}, 400
 
-            sender_ref, 
+    users_ref = db.collection('users')
+    sender_ref = users_ref.document(sender_uid)
+    for i in range(0, len(awards), AWARDS_PER_COMMIT):
+        chunk = awards[i:i + AWARDS_PER_COMMIT]
+        try:
+            with firestore_call("award_chunk"):
+                award_chunk_transactional(
+                    db.transaction(),
+                    sender_ref,
+                    sender_uid,
+                    user['name'],
+                    [{"amount": r["amount"], **r["recipient"]} for r in chunk]
+                )
+            for result in chunk:
+                result["status"] = "ok"
+        except Exception as e:
+            for result in chunk:
+                result.update(status="failed", message=f"Transaction failed: {e}")
+
+    invalidate_user_profile(sender_uid, *(r["recipient"]["uid"] for r in awards))
+    for result in results:
+        result.pop("recipient", None)
+
+    return {
+        "results": results,
+        "sent": sum(1 for r in results if r["status"] == "ok"),
+        "failed": sum(1 for r in results if r["status"] == "failed")
+    }, 200
+
+
+@app.route("/transactions/send-batch", methods=["POST"])
+@login_required
+def send_transaction_batch():
+    data = request.get_json()
+    body, status = award_batch(g.user, data.get('items') if data else None)
+    return jsonify(body), status
 
-            recipient_ref, 
 
-            amount, 
+def encode_search_cursor(position):
+    """Opaque cursor for a UserIndex search position, None at the end."""
+    if not position:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
 
-            sender_uid, 
 
-            recipient_uid, 
+def decode_search_cursor(cursor):
+    if not cursor:
+        return None
+    position = tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
+    if not (len(position) == 2 and all(isinstance(part, str) for part in position)):
+        raise ValueError("Malformed search cursor")
+    return position
 
-            g.user['name'], 
 
-            recipient_data['name']
+def encode_cursor(timestamp, doc_id):
+    """Opaque keyset cursor pointing at the last transaction of a page."""
+    raw = json.dumps({"t": timestamp.isoformat(), "id": doc_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
-        )
 
-        
+def decode_cursor(cursor):
+    raw = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.datetime.fromisoformat(raw["t"]), raw["id"]
 
-        return jsonify({"message": "Transaction successful"}), 200
 
-    except Exception as e:
+def ordered_transactions(field, user_uid, after, limit):
+    """Stream the user's transactions where `field` matches, newest first.
 
-        return jsonify({"message": f"Transaction failed: {e}"}), 500
+    Ordering is (timestamp, document id) descending so the cursor is stable
+    even when two transactions share a timestamp. Needs the composite index
+    (field ASC, timestamp DESC, __name__ DESC).
+    """
+    transactions_ref = db.collection('transactions')
+    query = (
+        transactions_ref
+        .where(field, '==', user_uid)
+        .order_by('timestamp', direction=firestore.Query.DESCENDING)
+        .order_by('__name__', direction=firestore.Query.DESCENDING)
+    )
+    if after:
+        timestamp, doc_id = after
+        query = query.start_after({
+            'timestamp': timestamp,
+            '__name__': transactions_ref.document(doc_id)
+        })
+    return query.limit(limit).stream()
+
+
+def feed_transactions(user_uid, after, limit):
+    """Page through the user's materialized feed, newest first."""
+    feed_ref = db.collection('users').document(user_uid).collection('feed')
+    query = (
+        feed_ref
+        .order_by('timestamp', direction=firestore.Query.DESCENDING)
+        .order_by('__name__', direction=firestore.Query.DESCENDING)
+    )
+    if after:
+        timestamp, doc_id = after
+        query = query.start_after({
+            'timestamp': timestamp,
+            '__name__': feed_ref.document(doc_id)
+        })
+    with firestore_call("feed_transactions"):
+        return list(query.limit(limit).stream())
+
+
+def merged_transactions(user_uid, after, limit):
+    """Page through the global collection for users without a feed yet."""
+    # Each stream reads at most `limit` documents; merging them lazily
+    # means we stop as soon as the page is filled.
+    sent = ordered_transactions('sender_uid', user_uid, after, limit)
+    received = ordered_transactions('recipient_uid', user_uid, after, limit)
+    merged = heapq.merge(
+        sent,
+        received,
+        key=lambda doc: (doc.get('timestamp'), doc.id),
+        reverse=True
+    )
+    with firestore_call("merged_transactions"):
+        return list(itertools.islice(merged, limit))
 
 
+def count_transactions(user):
+    """Total number of transactions the user took part in.
 
+    Uses the `tx_count` counter kept by update_balances_transactional and only
+    falls back to count aggregations for profiles created before it existed.
+    """
+    if 'tx_count' in user:
+        return user['tx_count']
 
+    total = 0
+    with firestore_call("count_transactions"):
+        for field in ('sender_uid', 'recipient_uid'):
+            query = db.collection('transactions').where(field, '==', user['uid'])
+            total += query.count().get()[0][0].value
+    return total
 
-@app.route("/transactions")
 
+@app.route("/transactions")
 @login_required
-
 def get_transactions():
-
     user_uid = g.user['uid']
 
-    
-
-    # Query for transactions where the user is the sender OR the recipient
-
-    sent_query = db.collection('transactions').where('sender_uid', '==', user_uid)
-
-    received_query = db.collection('transactions').where('recipient_uid', '==', user_uid)
-
-
-
+    limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor')
     try:
+        after = decode_cursor(cursor) if cursor else None
+    except (ValueError, KeyError, TypeError):
+        return jsonify({"message": "Invalid cursor"}), 400
 
-        sent_transactions = [doc.to_dict() for doc in sent_query.get()]
-
-        received_transactions = [doc.to_dict() for doc in received_query.get()]
-
+    # Read one extra document to know whether another page exists
+    try:
+        if g.user.get('feed'):
+            docs = feed_transactions(user_uid, after, limit + 1)
+        else:
+            docs = merged_transactions(user_uid, after, limit + 1)
+        total = count_transactions(g.user)
     except Exception as e:
-
         return jsonify({"message": f"Failed to retrieve transactions: {e}"}), 500
 
-
-
-    # Combine and sort by timestamp
-
-    all_transactions = sorted(
-
-        sent_transactions + received_transactions,
-
-        key=lambda x: x['timestamp'],
-
-        reverse=True
-
-    )
-
-    
-
-    # Simple pagination
-
-    page = request.args.get('page', 1, type=int)
-
-    limit = request.args.get('limit', 10, type=int)
-
-    start = (page - 1) * limit
-
-    end = start + limit
-
-    
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1].get('timestamp'), docs[-1].id)
 
     return jsonify({
-
-        "transactions": all_transactions[start:end],
-
-        "total": len(all_transactions)
-
+        "transactions": [{**doc.to_dict(), "id": doc.id} for doc in docs],
+        "total": total,
+        "next_cursor": next_cursor
     })
 
 
-
 @firestore.transactional
-
 def mine_coins_transactional(transaction, user_ref):
-
-    transaction.update(user_ref, {'balance': firestore.Increment(10)})
-
+    TRANSACTION_ATTEMPTS.inc(op="mine_coins")
+    shards = read_balance_shards(transaction, [user_ref])[user_ref.id]
+    credit_balance(transaction, user_ref, 10, tx_count=0, shards=shards)
 
 
 @app.route("/mine", methods=["GET"])
-
 @login_required
-
 def mine():
-
     try:
-
         user_uid = g.user['uid']
-
         user_ref = db.collection('users').document(user_uid)
 
-
-
         transaction = db.transaction()
-
-        mine_coins_transactional(transaction, user_ref)
-
-
+        with firestore_call("mine_coins"):
+            mine_coins_transactional(transaction, user_ref)
 
         # Re-fetch the user's profile to get the updated balance
-
-        updated_user_profile = get_user_profile(user_uid)
-
-        
+        invalidate_user_profile(user_uid)
+        updated_user_profile = get_user_profile(user_uid, use_cache=False)
 
         return jsonify({
-
             "message": "Successfully mined 10 Leafcoin!",
-
             "new_balance": updated_user_profile['balance']
-
         }), 200
-
     except Exception as e:
-
         return jsonify({"message": f"Mining failed: {e}"}), 500
@@ -0,0 +1,155 @@
+"""Header-first sync with the other nodes.
+
+A consensus round used to download every peer's whole chain, one peer after
+another. Now it:
+
+1. asks every peer for its tip summary (height, tip hash, cumulative work)
+   at the same time,
+2. takes the peer with the most work, if it has more than us,
+3. finds the fork point with that peer from a block locator (hashes of our
+   blocks at exponentially spaced heights) and downloads only the blocks
+   after it.
+
+If the best peer's blocks don't check out, the next best one is tried.
+
+Nodes also push their new tip to each other (announce()) as soon as they
+mine or accept a block, so a round usually starts right away instead of
+waiting for the next poll.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+import validation
+
+# Seconds to wait for a peer's tip summary; a slow peer just sits out the round
+TIP_TIMEOUT = 2
+
+_pool = None
+
+
+def chain_work(chain, strategy):
+    """Cumulative work of a chain. Every block is checked against the same
+    difficulty, so each one adds the same work."""
+    return len(chain) * strategy.work(chain[-1])
+
+
+def block_locator(chain):
+    """Hashes of the last ten blocks, then of blocks at doubling distances
+    back from the tip, ending with the genesis block."""
+    hashes = []
+    index = len(chain) - 1
+    step = 1
+    while index > 0:
+        hashes.append(chain[index].hash)
+        if len(hashes) >= 10:
+            step *= 2
+        index -= step
+    hashes.append(chain[0].hash)
+    return hashes
+
+
+def locate_fork(chain, block_index, locator):
+    """Peer side of block_locator(): the first locator hash that is in our
+    chain, as (index, hash), or None if we share no block."""
+    for block_hash in locator:
+        index = block_index.get(block_hash)
+        if index is not None and index < len(chain) and chain[index].hash == block_hash:
+            return index, block_hash
+    return None
+
+
+def pool(size):
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=max(1, size), thread_name_prefix="sync")
+    return _pool
+
+
+def fetch_tip(node_url):
+    try:
+        response = http_client.get(url=node_url + "/tip", timeout=TIP_TIMEOUT)
+        response.raise_for_status()
+        tip = response.json()
+        return node_url, int(tip['height']), int(tip['work'])
+    except Exception as e:
+        print(f"Error fetching tip from {node_url}: {e}")
+        return node_url, None, None
+
+
+def peer_tips(peers):
+    """Tip summaries of every peer, fetched concurrently. Peers that fail
+    to answer are left out."""
+    if not peers:
+        return []
+    results = pool(len(peers)).map(fetch_tip, peers)
+    return [(url, height, work) for url, height, work in results if height is not None]
+
+
+def fork_work(fork, suffix, strategy):
+    """Cumulative work of our chain up to fork followed by suffix."""
+    return (fork + 1 + len(suffix)) * strategy.work(suffix[-1])
+
+
+def fetch_missing_blocks(node_url, blockchain, strategy, executor=None, confirmed=None):
+    """Download and validate a peer's blocks after our fork point with it.
+    confirmed is passed on to validation.validate_suffix().
+
+    Returns (fork, suffix): the peer's chain is our blocks up to index fork
+    followed by suffix. Raises ValueError if the peer's blocks are invalid.
+    """
+    response = http_client.get(
+        url=node_url + "/blocks/fork-point",
+        params={'locator': ",".join(block_locator(blockchain))},
+        timeout=5
+    )
+    if response.status_code == 404:
+        raise ValueError("no common block")
+    response.raise_for_status()
+    fork = response.json()
+    fork_index = int(fork['index'])
+    if fork_index >= len(blockchain) or blockchain[fork_index].hash != fork['hash']:
+        raise ValueError("fork point is not in our chain")
+
+    response = http_client.get(url=node_url + "/blocks", params={'from': fork_index + 1}, timeout=30)
+    response.raise_for_status()
+    suffix = validation.blocks_from_dicts(response.json())
+    if not suffix:
+        raise ValueError("no blocks after the fork point")
+    validation.validate_suffix(blockchain[fork_index], suffix, strategy, executor, confirmed=confirmed)
+    return fork_index, suffix
+
+
+def best_chain(peers, blockchain, strategy, executor=None, confirmed=None):
+    """The valid peer chain with the most work, if it has more than ours, as
+    (fork, suffix). Only the tip and a few blocks of blockchain are read, so
+    it can be a BlockStore."""
+    our_work = chain_work(blockchain, strategy)
+    tips = sorted(peer_tips(peers), key=lambda tip: tip[2], reverse=True)
+    for node_url, height, work in tips:
+        if work <= our_work:
+            break
+        try:
+            fork, suffix = fetch_missing_blocks(node_url, blockchain, strategy, executor, confirmed)
+        except ValueError as e:
+            print(f"Rejected chain from {node_url}: {e}")
+            continue
+        except Exception as e:
+            print(f"Error fetching blocks from {node_url}: {e}")
+            continue
+        if fork_work(fork, suffix, strategy) > our_work:
+            return fork, suffix
+    return None
+
+
+def post_announcement(node_url, announcement):
+    try:
+        http_client.post(url=node_url + "/blocks/announce", json=announcement, timeout=TIP_TIMEOUT, retries=0)
+    except Exception as e:
+        print(f"Error announcing block to {node_url}: {e}")
+
+
+def announce(peers, announcement):
+    """Push a new tip to every peer without waiting for their answers."""
+    for node_url in peers:
+        pool(len(peers)).submit(post_announcement, node_url, announcement)
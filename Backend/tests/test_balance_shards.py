@@ -0,0 +1,79 @@
+"""Balances stay whole while sharding is turned on, off or resized.
+
+Runs server.py against the in-memory Firestore from benchmarks/.
+"""
+
+import os
+import sys
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.join(BACKEND, "benchmarks"))
+
+import fake_firestore  # noqa: E402
+
+client = fake_firestore.install()
+
+import server  # noqa: E402
+from firebase import firebase_code  # noqa: E402
+
+
+def seed():
+    client._collections.clear()
+    firebase_code.profile_cache.clear()
+    firebase_code.college_id_cache.clear()
+    for uid, college_id, balance in (("u0", "C0", 100), ("u1", "C1", 7)):
+        client.collection("users").document(uid).set({
+            "uid": uid, "name": uid, "college_id": college_id, "balance": balance, "tx_count": 0
+        })
+        client.collection("college_ids").document(firebase_code.college_id_key(college_id)).set({"uid": uid, "name": uid})
+
+
+def send(college_id, amount):
+    response = server.app.test_client().post(
+        "/transactions/send", json={"recipientId": college_id, "amount": amount},
+        headers={"Authorization": "Bearer token-u0"}
+    )
+    assert response.status_code == 200, response.get_json()
+
+
+def balance(uid):
+    return firebase_code.get_user_profile(uid, use_cache=False)["balance"]
+
+
+def shard_ids(uid):
+    return sorted(doc.id for doc in client.collection(f"users/{uid}/balance_shards").stream())
+
+
+def test_credit_after_disable_with_stale_cache():
+    seed()
+    firebase_code.enable_sharded_balance("u1", 4)
+    send("C1", 5)
+    assert balance("u1") == 12
+
+    firebase_code.disable_sharded_balance("u1")
+    # Another worker still caches the index entry from when u1 was sharded
+    firebase_code.college_id_cache.set("C1", {"uid": "u1", "name": "u1", "balance_shards": 4})
+    send("C1", 10)
+
+    assert balance("u1") == 22
+    assert balance("u0") == 85
+    assert shard_ids("u1") == []
+
+
+def test_reshard_keeps_every_shard():
+    seed()
+    firebase_code.enable_sharded_balance("u1", 4)
+    for _ in range(8):
+        send("C1", 1)
+    # A credit left on a shard beyond the current count
+    client.collection("users/u1/balance_shards").document("9").set({"balance": 3, "tx_count": 1})
+
+    firebase_code.enable_sharded_balance("u1", 2)
+    assert shard_ids("u1") == ["0", "1"]
+    assert balance("u1") == 7 + 8 + 3
+
+    firebase_code.disable_sharded_balance("u1")
+    assert shard_ids("u1") == []
+    profile = firebase_code.get_user_profile("u1", use_cache=False)
+    assert (profile["balance"], profile["tx_count"]) == (18, 9)
@@ -0,0 +1,105 @@
+"""In-memory prefix index over users' names and college ids, used by
+GET /users/search.
+
+The index is filled from a Firestore snapshot listener on the `users`
+collection, so after the first load it only receives the documents that
+changed. Only the display fields are kept; everything else on a profile
+(keys, email, balance) never enters the index.
+"""
+
+import bisect
+import threading
+
+DISPLAY_FIELDS = ("uid", "name", "college_id", "department", "role")
+
+
+def index_keys(profile):
+    """Lowercased keys a profile can be found by: its college id, its full
+    name and every word of the name."""
+    keys = set()
+    if profile.get("college_id"):
+        keys.add(str(profile["college_id"]).lower())
+    name = (profile.get("name") or "").lower().strip()
+    if name:
+        keys.add(name)
+        keys.update(name.split())
+    return keys
+
+
+class UserIndex:
+    def __init__(self):
+        self._entries = {}
+        self._keys_by_uid = {}
+        # Sorted (key, uid) pairs; a prefix search is a bisect plus a scan
+        self._sorted = []
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._watch = None
+
+    def start(self, users_ref, timeout=10):
+        """Start listening to the users collection, once per process, and
+        wait up to timeout seconds for the initial load."""
+        with self._lock:
+            if self._watch is None:
+                self._watch = users_ref.on_snapshot(self._on_snapshot)
+        self._loaded.wait(timeout)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        for change in changes:
+            if change.type.name == "REMOVED":
+                self.remove(change.document.id)
+            else:
+                self.update(change.document.id, change.document.to_dict())
+        self._loaded.set()
+
+    def update(self, uid, profile):
+        entry = {field: profile.get(field) for field in DISPLAY_FIELDS}
+        entry["uid"] = uid
+        keys = index_keys(profile)
+        with self._lock:
+            self._remove_keys(uid)
+            self._entries[uid] = entry
+            self._keys_by_uid[uid] = keys
+            for key in keys:
+                bisect.insort(self._sorted, (key, uid))
+
+    def remove(self, uid):
+        with self._lock:
+            self._remove_keys(uid)
+            self._entries.pop(uid, None)
+
+    def _remove_keys(self, uid):
+        for key in self._keys_by_uid.pop(uid, ()):
+            i = bisect.bisect_left(self._sorted, (key, uid))
+            if i < len(self._sorted) and self._sorted[i] == (key, uid):
+                del self._sorted[i]
+
+    def search(self, query, limit, after=None, exclude=None):
+        """Return up to limit entries with a key starting with query, ordered
+        by the matching key, plus the (key, uid) position to resume from.
+
+        Args:
+            after (tuple): Position returned by the previous page.
+            exclude (str): uid left out of the results (the caller).
+        """
+        prefix = query.lower().strip()
+        results = []
+        with self._lock:
+            start = after if after else (prefix, "")
+            i = bisect.bisect_right(self._sorted, start)
+            while i < len(self._sorted) and len(results) <= limit:
+                key, uid = self._sorted[i]
+                i += 1
+                if not key.startswith(prefix):
+                    break
+                # A user can match through several keys; only return them
+                # at the first one so pages never repeat a user.
+                if uid == exclude or key != min(k for k in self._keys_by_uid[uid] if k.startswith(prefix)):
+                    continue
+                results.append((key, uid, dict(self._entries[uid])))
+
+        next_position = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_position = results[-1][:2]
+        return [entry for _, _, entry in results], next_position
@@ -0,0 +1,157 @@
+"""Incremental, parallel validation of peer chains.
+
+A peer chain is compared with ours to find the last block both share (the
+fork point). Only the blocks after it are checked: index sequence, hash
+link to the previous block, proof of work and transaction signatures.
+Those checks only look at a block and its predecessor, so the suffix is
+split into runs of consecutive blocks that worker processes validate
+independently. That no transaction is confirmed twice is checked after
+them, against the ids of our chain up to the fork point.
+"""
+
+from block import Block, serialize_transaction
+from mempool import transaction_id
+import verify
+
+# Smallest run of blocks sent to one worker; smaller runs cost more in
+# pickling than they save
+MIN_CHUNK = 256
+
+
+def find_fork_point(local_chain, peer_chain):
+    """Index of the last block with the same hash in both chains, or -1.
+
+    Hashes commit to everything before them, so matches form a prefix and
+    a binary search only hashes O(log n) peer blocks.
+    """
+    low, high = 0, min(len(local_chain), len(peer_chain)) - 1
+    fork = -1
+    while low <= high:
+        middle = (low + high) // 2
+        if local_chain[middle].hash == peer_chain[middle].hash:
+            fork = middle
+            low = middle + 1
+        else:
+            high = middle - 1
+    return fork
+
+
+def validate_transactions(block):
+    """Returns an error message, or None if the block's transactions are valid."""
+    rewards = 0
+    # A repeated transaction would give the block the hash of the same
+    # block without the repeat, see block.merkle_root()
+    seen = set()
+    for txion in block.transactions:
+        if not isinstance(txion, dict) or not {'from', 'to', 'amount'} <= txion.keys():
+            return "malformed transaction"
+        serialized = serialize_transaction(txion)
+        if serialized in seen:
+            return "repeated transaction"
+        seen.add(serialized)
+        if txion['from'] == "network":
+            rewards += 1
+            if rewards > 1 or txion['amount'] != 1:
+                return "invalid mining reward"
+        elif not verify.verify_transaction(txion):
+            return "invalid transaction signature"
+    return None
+
+
+def find_repeated_transaction(fork, blocks, confirmed):
+    """Error message for the first transaction of blocks that our chain up
+    to index fork (confirmed maps transaction ids to block indexes) or an
+    earlier one of blocks already has, or None."""
+    seen = set()
+    for block in blocks:
+        for txion in block.transactions:
+            if not isinstance(txion, dict) or txion.get('from') == "network":
+                continue
+            txion_id = transaction_id(txion)
+            if txion_id in seen or confirmed.get(txion_id, fork + 1) <= fork:
+                return f"block {block.index}: transaction already in the chain"
+            seen.add(txion_id)
+    return None
+
+
+def validate_blocks(previous_block, blocks, strategy, check_signatures=True):
+    """Check a run of consecutive blocks on top of previous_block.
+
+    Returns (error message or None, block hashes), so a caller in another
+    process can cache the hashes instead of computing them again.
+    """
+    previous = previous_block
+    for block in blocks:
+        if block.index != previous.index + 1:
+            return f"block {block.index}: expected index {previous.index + 1}", None
+        if block.previous_hash != previous.hash:
+            return f"block {block.index}: does not link to block {previous.index}", None
+        if not strategy.is_valid(block, previous):
+            return f"block {block.index}: invalid proof of work", None
+        error = validate_transactions(block) if check_signatures else None
+        if error:
+            return f"block {block.index}: {error}", None
+        previous = block
+    return None, [block.hash for block in blocks]
+
+
+def validate_suffix(previous_block, suffix, strategy, executor=None, check_signatures=True, confirmed=None):
+    """Validate blocks on top of previous_block, in parallel when an executor
+    is given. Raises ValueError at the first invalid block.
+
+    confirmed maps the transaction ids of our chain to the index of their
+    block (BalanceIndex.confirmed); without it, only repeats within suffix
+    are caught.
+    """
+    if not suffix:
+        return
+    workers = getattr(executor, '_max_workers', 1) if executor else 1
+    chunk = max(MIN_CHUNK, -(-len(suffix) // (workers * 4)))
+    runs = [suffix[i:i + chunk] for i in range(0, len(suffix), chunk)]
+    previous_blocks = [previous_block] + [run[-1] for run in runs[:-1]]
+
+    if executor is None or len(runs) == 1:
+        results = [validate_blocks(p, run, strategy, check_signatures) for p, run in zip(previous_blocks, runs)]
+    else:
+        results = executor.map(
+            validate_blocks,
+            previous_blocks,
+            runs,
+            [strategy] * len(runs),
+            [check_signatures] * len(runs)
+        )
+
+    for run, (error, hashes) in zip(runs, results):
+        if error:
+            raise ValueError(error)
+        for block, block_hash in zip(run, hashes):
+            block._hash = block_hash
+
+    error = find_repeated_transaction(previous_block.index, suffix, confirmed or {})
+    if error:
+        raise ValueError(error)
+
+
+def validate_chain(local_chain, peer_chain, strategy, executor=None, check_signatures=True, confirmed=None):
+    """Validate peer_chain (a list of Blocks) against local_chain.
+
+    Only the part after the fork point is checked, in parallel when an
+    executor is given.
+
+    Returns (fork, suffix): the chain to adopt is local_chain[:fork + 1] +
+    suffix. Raises ValueError if the peer chain is invalid.
+    """
+    fork = find_fork_point(local_chain, peer_chain)
+    if fork < 0:
+        raise ValueError("no common genesis block")
+    suffix = peer_chain[fork + 1:]
+    validate_suffix(local_chain[fork], suffix, strategy, executor, check_signatures, confirmed)
+    return fork, suffix
+
+
+def blocks_from_dicts(block_dicts):
+    """Build Blocks from a peer's JSON, rejecting anything malformed."""
+    try:
+        return [Block.from_dict(block_dict) for block_dict in block_dicts]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"malformed block: {e}")
@@ -0,0 +1,64 @@
+"""Transaction signature verification for the miner node.
+
+Parsed verifying keys are kept in an LRU cache per sender address, so a
+sender's key is decoded and checked to be on the curve once per worker
+instead of on every transaction. Verification itself runs in a process pool
+so the node's accept rate scales with cores instead of one interpreter.
+"""
+
+import base64
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import ecdsa
+
+_executor = None
+
+
+@lru_cache(maxsize=4096)
+def verifying_key(public_key):
+    """Parse a base64 wallet address into an ecdsa.VerifyingKey."""
+    return ecdsa.VerifyingKey.from_string(base64.b64decode(public_key), curve=ecdsa.SECP256k1)
+
+
+def verify_signature(public_key, signature, message):
+    """Verifies if the signature is correct. This is used to prove
+    it's you (and not someone else) trying to do a transaction with your
+    address.
+    """
+    try:
+        return verifying_key(public_key).verify(base64.b64decode(signature), message.encode())
+    except Exception as e:
+        print(f"Signature validation error: {e}")
+        return False
+
+
+def verify_transaction(txion):
+    """verify_signature() for a transaction dict. Malformed ones are invalid."""
+    try:
+        return verify_signature(txion['from'], txion['signature'], txion['message'])
+    except (KeyError, TypeError):
+        return False
+
+
+def executor(workers=None):
+    """The process pool verification runs in, created on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+    return _executor
+
+
+def verify_async(txion):
+    """Submit one transaction to the pool. Returns a Future of its result."""
+    return executor().submit(verify_transaction, txion)
+
+
+def verify_many(txions):
+    """Verify a list of transactions in parallel, results in the same order."""
+    if not txions:
+        return []
+    # Chunks amortize the inter-process overhead over several signatures
+    chunksize = max(1, len(txions) // (4 * (os.cpu_count() or 1)))
+    return list(executor().map(verify_transaction, txions, chunksize=chunksize))
@@ -13,26 +13,54 @@ going to mine).
 
 Timestamp in hashed message. When you send your transaction it will be received
 by several nodes. If any node mine a block, your transaction will get added to the
-blockchain but other nodes still will have it pending. If any node see that your
-transaction with same timestamp was added, they should remove it from the
-node_pending_transactions list to avoid it get processed more than 1 time.
+blockchain but other nodes still will have it pending. Nodes keep one copy of
+each signed transaction in their pool and remove it once a block with it is
+accepted, so it doesn't get processed more than 1 time.
 """
 
 import requests
+import csv
+import json
+import os
 import time
 import base64
 import ecdsa
-import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import http_client
+import sync
+import validation
+from balances import BalanceIndex, transaction_amount
+from block import create_genesis_block
+from blockstore import BlockStore
+
+# Nodes the wallet talks to, tried in order. Set WALLET_NODES to a comma
+# separated list of node urls to use others.
+NODES = [url.rstrip("/") for url in os.environ.get(
+    "WALLET_NODES", "https://kryptobytes-7.onrender.com").split(",") if url.strip()]
+
+# Local copy of the chain, so checking a balance only downloads new blocks
+CACHE_DIR = os.path.expanduser(os.environ.get("WALLET_CACHE_DIR", "~/.kryptobytes-wallet"))
+
+# Transactions shown per address when checking transactions
+HISTORY_SIZE = 10
+
+# Transactions per /txion/batch request of a bulk send
+BROADCAST_BATCH = 200
+
+# Signing key of a bulk signing worker, parsed once per process
+_signing_key = None
 
 
 def wallet():
     response = None
-    while response not in ["1", "2", "3", "4"]:
+    while response not in ["1", "2", "3", "4", "5"]:
         response = input("""What do you want to do?
         1. Generate new wallet
         2. Send coins to another wallet
         3. Check transactions
-        4. Quit\n""")
+        4. Send coins to many wallets from a CSV/JSONL file
+        5. Quit\n""")
     if response == "1":
         # Generate new wallet
         print("""=========================================\n
@@ -52,8 +80,16 @@ IMPORTANT: save this credentials or you won't be able to recover your wallet\n
             send_transaction(addr_from, private_key, addr_to, amount)
         elif response.lower() == "n":
             return wallet()  # return to main menu
-    elif response == "3":  # Will always occur when response == 3.
-        check_transactions()
+    elif response == "4":
+        addr_from = input("From: introduce your wallet address (public key)\n")
+        private_key = input("Introduce your private key\n")
+        path = input("File with one transfer per row (to, amount), .csv or .jsonl\n")
+        report_path = input("Where to save the report (leave empty to skip)\n")
+        bulk_send(addr_from, private_key, path, report_path=report_path or None)
+        return wallet()  # return to main menu
+    elif response == "3":
+        addresses = input("Introduce your wallet addresses (public keys), separated by commas\n")
+        check_transactions([a.strip() for a in addresses.split(",") if a.strip()])
         return wallet()  # return to main menu
     else:
         quit()
@@ -74,7 +110,6 @@ def send_transaction(addr_from, private_key, addr_to, amount):
 
     if len(private_key) == 64:
         signature, message = sign_ECDSA_msg(private_key)
-        url = 'https://kryptobytes-7.onrender.com/txion'
         payload = {"from": addr_from,
                    "to": addr_to,
                    "amount": amount,
@@ -82,22 +117,210 @@ def send_transaction(addr_from, private_key, addr_to, amount):
                    "message": message}
         headers = {"Content-Type": "application/json"}
 
-        res = requests.post(url, json=payload, headers=headers)
-        print(res.text)
+        for node_url in NODES:
+            try:
+                res = http_client.post(node_url + '/txion', json=payload, headers=headers, timeout=10)
+                print(f"{node_url}: {res.text}")
+            except requests.RequestException as e:
+                print(f"{node_url}: {e}")
     else:
         print("Wrong address or key length! Verify and try again.")
 
 
-def check_transactions():
-    """Retrieve the entire blockchain. With this you can check your
-    wallets balance. If the blockchain is to long, it may take some time to load.
+def read_transfers(path):
+    """(to, amount) rows of a CSV file (with a to,amount header or without
+    one) or of a JSONL file of {"to": ..., "amount": ...} objects."""
+    transfers = []
+    with open(path, newline="") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    transfers.append((row["to"], row["amount"]))
+        else:
+            for row in csv.reader(f):
+                if not row or row[0].strip().lower() == "to":
+                    continue
+                transfers.append((row[0].strip(), row[1].strip()))
+    return transfers
+
+
+def _init_signer(private_key):
+    global _signing_key
+    _signing_key = ecdsa.SigningKey.from_string(bytes.fromhex(private_key), curve=ecdsa.SECP256k1)
+
+
+def _sign_transfer(transfer):
+    """Sign one transfer with the worker's key, like sign_ECDSA_msg()."""
+    addr_from, addr_to, amount = transfer
+    message = str(round(time.time()))
+    signature = base64.b64encode(_signing_key.sign(message.encode())).decode()
+    return {"from": addr_from, "to": addr_to, "amount": amount, "signature": signature, "message": message}
+
+
+def sign_transfers(addr_from, private_key, transfers, workers=None):
+    """Sign many transfers in a process pool. Each worker parses the
+    signing key once."""
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_signer, initargs=(private_key,)) as pool:
+        chunksize = max(1, len(transfers) // (4 * (os.cpu_count() or 1)))
+        return list(pool.map(_sign_transfer, [(addr_from, to, amount) for to, amount in transfers], chunksize=chunksize))
+
+
+def broadcast_to_node(node_url, txions):
+    """Send signed transactions to one node in batches. Returns the node's
+    report and, per transaction, None if accepted or the reason it wasn't."""
+    started = time.time()
+    outcomes = []
+    for i in range(0, len(txions), BROADCAST_BATCH):
+        batch = txions[i:i + BROADCAST_BATCH]
+        try:
+            response = http_client.post(node_url + '/txion/batch', json=batch, timeout=30)
+            response.raise_for_status()
+            outcomes.extend(None if r["accepted"] else r.get("error", "rejected") for r in response.json()["results"])
+        except (requests.RequestException, ValueError, KeyError) as e:
+            outcomes.extend([f"request failed: {e}"] * len(batch))
+    return {
+        "node": node_url,
+        "accepted": outcomes.count(None),
+        "rejected": len(outcomes) - outcomes.count(None),
+        "seconds": round(time.time() - started, 3)
+    }, outcomes
+
+
+def bulk_send(addr_from, private_key, path, nodes=None, report_path=None):
+    """Send every transfer in a CSV/JSONL file: sign them all in parallel,
+    then broadcast them to every node at the same time. Prints a summary and
+    returns (or saves to report_path) a report per transaction and per node.
+    """
+    nodes = nodes or NODES
+    if len(private_key) != 64:
+        print("Wrong address or key length! Verify and try again.")
+        return None
+    transfers = read_transfers(path)
+    started = time.time()
+    txions = sign_transfers(addr_from, private_key, transfers)
+    print(f"Signed {len(txions)} transactions in {time.time() - started:.1f}s")
+
+    with ThreadPoolExecutor(max_workers=len(nodes)) as pool:
+        results = list(pool.map(lambda node_url: broadcast_to_node(node_url, txions), nodes))
+
+    report = {"nodes": [node_report for node_report, _ in results], "transactions": []}
+    for i, txion in enumerate(txions):
+        errors = {node_url: outcomes[i] for node_url, (_, outcomes) in zip(nodes, results) if outcomes[i]}
+        report["transactions"].append({
+            "row": i + 1,
+            "to": txion["to"],
+            "amount": txion["amount"],
+            "signature": txion["signature"],
+            "accepted_by": len(nodes) - len(errors),
+            "errors": errors
+        })
+
+    for node_report in report["nodes"]:
+        print(f"{node_report['node']}: {node_report['accepted']} accepted, "
+              f"{node_report['rejected']} rejected in {node_report['seconds']}s")
+    unsent = sum(1 for t in report["transactions"] if not t["accepted_by"])
+    print(f"{len(txions) - unsent} of {len(txions)} transactions reached at least one node")
+    if report_path:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def check_links(previous_block, blocks):
+    """Check that downloaded blocks follow on from previous_block (None for
+    a chain that starts with them) and from each other. The proof of work
+    and signatures are left to the nodes."""
+    if previous_block is None:
+        if blocks[0].hash != create_genesis_block().hash:
+            raise ValueError("the node's chain has a different genesis block")
+        previous_block, blocks = blocks[0], blocks[1:]
+    for block in blocks:
+        if block.index != previous_block.index + 1 or block.previous_hash != previous_block.hash:
+            raise ValueError(f"block {block.index} does not follow block {previous_block.index}")
+        previous_block = block
+
+
+def fetch_new_blocks(node_url, store):
+    """Blocks of the node's chain that we don't have, as (fork, blocks):
+    our blocks up to index fork are kept and blocks go after them."""
+    if not len(store):
+        response = http_client.get(node_url + '/blocks', timeout=30)
+        response.raise_for_status()
+        blocks = validation.blocks_from_dicts(response.json())
+        if blocks:
+            check_links(None, blocks)
+        return -1, blocks
+
+    tip = store[-1]
+    response = http_client.get(
+        node_url + '/blocks',
+        params={'since_hash': tip.hash},
+        headers={'If-None-Match': f'"{tip.hash}"'},
+        timeout=30
+    )
+    if response.status_code == 304:
+        return tip.index, []
+    if response.status_code == 404:
+        # The node dropped our tip in a reorg. Find the last block we share.
+        response = http_client.get(
+            node_url + '/blocks/fork-point',
+            params={'locator': ",".join(sync.block_locator(store))},
+            timeout=10
+        )
+        response.raise_for_status()
+        fork = int(response.json()['index'])
+        response = http_client.get(node_url + '/blocks', params={'from': fork + 1}, timeout=30)
+    else:
+        fork = tip.index
+    response.raise_for_status()
+    blocks = validation.blocks_from_dicts(response.json())
+    if blocks:
+        check_links(store[fork], blocks)
+    return fork, blocks
+
+
+def sync_chain():
+    """Bring the local chain cache up to date with the first node that
+    answers. Returns the cache and its balance index."""
+    store = BlockStore(CACHE_DIR)
+    index = BalanceIndex(os.path.join(CACHE_DIR, 'balances.json'), snapshot_every=1)
+    index.load(store)
+    for node_url in NODES:
+        try:
+            fork, blocks = fetch_new_blocks(node_url, store)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Could not sync with {node_url}: {e}")
+            continue
+        if blocks:
+            dropped = store[fork + 1:]
+            store.truncate(fork + 1)
+            store.extend(blocks)
+            index.apply_update(fork, dropped, blocks)
+        print(f"Synced {len(blocks)} new blocks from {node_url}, height {len(store) - 1}")
+        break
+    return store, index
+
+
+def check_transactions(addresses=()):
+    """Sync the local copy of the blockchain and show the balance and
+    latest transactions of your addresses. Only blocks added since the last
+    check are downloaded.
     """
+    store, index = sync_chain()
     try:
-        res = requests.get('https://kryptobytes-7.onrender.com/blocks')
-        parsed = json.loads(res.text)
-        print(json.dumps(parsed, indent=4, sort_keys=True))
-    except requests.ConnectionError:
-        print('Connection error. Make sure that you have run miner.py in another terminal.')
+        for address in addresses:
+            balance, tx_count = index.balance(address)
+            print(f"\n{address}\nBalance: {balance}  ({tx_count} transactions)")
+            refs, _ = index.transaction_refs(address, limit=HISTORY_SIZE)
+            for block_index, position in refs:
+                txion = store[block_index].transactions[position]
+                if txion.get('from') == address:
+                    print(f"  block {block_index}: sent {transaction_amount(txion)} to {txion.get('to')}")
+                else:
+                    print(f"  block {block_index}: received {transaction_amount(txion)} from {txion.get('from')}")
+    finally:
+        store.close()
 
 
 def generate_ECDSA_keys():
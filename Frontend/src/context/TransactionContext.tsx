@@ -7,7 +7,8 @@ interface TransactionContextType {
   transactions: Transaction[];
   isFetching: boolean;
   isSending: boolean;
-  fetchTransactions: (page?: number, limit?: number) => Promise<void>;
+  nextCursor: string | null;
+  fetchTransactions: (limit?: number, cursor?: string) => Promise<void>;
   sendLeafcoin: (recipientId: string, amount: number) => Promise<boolean>;
 }
 
@@ -17,19 +18,22 @@ export function TransactionProvider({ children }: { children: ReactNode }) {
   const [transactions, setTransactions] = useState<Transaction[]>([]);
   const [isFetching, setIsFetching] = useState(false);
   const [isSending, setIsSending] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const { isAuthenticated, refreshUser } = useAuth();
 
-  const fetchTransactions = useCallback(async (page = 1, limit = 20) => {
+  const fetchTransactions = useCallback(async (limit = 20, cursor?: string) => {
     if (!isAuthenticated) return;
     setIsFetching(true);
     try {
-      const data = await apiGetTransactions(page, limit);
+      const data = await apiGetTransactions(limit, cursor);
       // Backend returns timestamps as strings, convert them to Date objects
       const formattedTransactions = data.transactions.map(t => ({
         ...t,
         timestamp: new Date(t.timestamp)
       }));
-      setTransactions(formattedTransactions);
+      // Passing a cursor loads the next page below the ones already shown
+      setTransactions(prev => cursor ? [...prev, ...formattedTransactions] : formattedTransactions);
+      setNextCursor(data.next_cursor ?? null);
     } catch (error) {
       console.error("Failed to fetch transactions:", error);
       setTransactions([]);
@@ -65,6 +69,7 @@ export function TransactionProvider({ children }: { children: ReactNode }) {
         transactions,
         isFetching,
         isSending,
+        nextCursor,
         fetchTransactions,
         sendLeafcoin,
       }}
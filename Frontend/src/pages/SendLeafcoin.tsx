@@ -7,7 +7,7 @@ import { Input } from '@/components/ui/input';
 import { useAuth } from '@/context/AuthContext';
 import { useTransactions } from '@/context/TransactionContext';
 import { useToast } from '@/hooks/use-toast';
-import { getUsers, sendTransaction } from '@/services/api';
+import { searchUsers, sendTransaction } from '@/services/api';
 import { User as UserType } from '@/types';
 
 
@@ -27,10 +27,9 @@ export default function SendLeafcoin() {
   useEffect(() => {
     const fetchUsers = async () => {
       try {
-        const fetchedUsers = await getUsers();
-        // Filter out the current user from the list
-        const otherUsers = fetchedUsers.filter(u => u.uid !== user?.uid);
-        setUsers(otherUsers);
+        // The server matches name/college ID prefixes and leaves out the current user
+        const { users: matches } = await searchUsers(searchQuery.trim());
+        setUsers(matches);
       } catch (error) {
         toast({
           title: 'Error fetching users',
@@ -40,16 +39,12 @@ export default function SendLeafcoin() {
       }
     };
 
-    if (user) {
-      fetchUsers();
-    }
-  }, [user, toast]);
+    if (!user) return;
+    const timeout = setTimeout(fetchUsers, 250);
+    return () => clearTimeout(timeout);
+  }, [user, searchQuery, toast]);
 
-  const filteredContacts = users.filter(
-    (contact) =>
-      contact.name.toLowerCase().includes(searchQuery.toLowerCase()) ||
-      contact.college_id.toLowerCase().includes(searchQuery.toLowerCase())
-  );
+  const filteredContacts = users;
 
   const handleSelectContact = (contact: UserType) => {
     setSelectedContact(contact);
@@ -49,12 +49,31 @@ export const apiLogin = (email, password) => {
     });
   };
   
-  export const getTransactions = (page = 1, limit = 10) => {
-    return apiRequest(`/transactions?page=${page}&limit=${limit}`);
+  export const sendTransactionBatch = (items: { recipientId: string; amount: number }[]) => {
+    return apiRequest('/transactions/send-batch', {
+      method: 'POST',
+      body: JSON.stringify({ items }),
+    });
+  };
+
+  export const getTransactions = (limit = 10, cursor?: string) => {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (cursor) {
+      params.append('cursor', cursor);
+    }
+    return apiRequest(`/transactions?${params.toString()}`);
+  };
+
+  export const getUsers = (cursor?: string) => {
+    return apiRequest(cursor ? `/users?cursor=${encodeURIComponent(cursor)}` : '/users');
   };
 
-  export const getUsers = () => {
-    return apiRequest('/users');
+  export const searchUsers = (q: string, limit = 20, cursor?: string) => {
+    const params = new URLSearchParams({ q, limit: String(limit) });
+    if (cursor) {
+      params.append('cursor', cursor);
+    }
+    return apiRequest(`/users/search?${params.toString()}`);
   };
 
   export const mineCoin = () => {